@@ -0,0 +1,76 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+from data_structures import DeployException
+
+
+# Account functions
+# --------------------------------------------------------------------------
+def get_missing_users(users, facts):
+    return [user for user in users if user.name not in facts['users']]
+
+def get_useradd(user):
+    if user.home_assistant_user:
+        return 'useradd -m -r {}'.format(user.name)
+
+    return 'useradd -m {} -G sudo'.format(user.name)
+
+def get_home_dirs(users, dirs):
+    cmds = []
+
+    for user in users:
+        if user.home_assistant_user:
+            continue
+
+        home = '/home/{}'.format(user.name)
+        paths = ' '.join(['{}/{}'.format(home, d) for d in dirs])
+
+        if paths:
+            cmds.append('mkdir -p {}'.format(paths))
+
+        cmds.append('chown -R {0}:{0} {1}'.format(user.name, home))
+
+    return cmds
+
+def render_passwords(users):
+    lines = []
+
+    for user in users:
+        password = user.password or ''
+
+        if ':' in user.name or '\n' in password:
+            raise DeployException('Cannot set the password of %s through chpasswd' % (user.name))
+
+        lines.append('{}:{}'.format(user.name, password))
+
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+def get_provision_cmd(missing, users, dirs):
+    # One round trip for any number of users, the passwords arrive on
+    # stdin for chpasswd and never show up on a command line
+    cmds = [get_useradd(user) for user in missing]
+    cmds.append('chpasswd')
+    cmds.extend(get_home_dirs(users, dirs))
+
+    return ' && '.join(cmds)
+
+def provision_users(session, users, dirs, facts):
+    # The caller drops its cached facts afterwards, the user list changed
+    missing = get_missing_users(users, facts)
+
+    if missing:
+        print('[%s] creating %d of %d users' % (session.host, len(missing), len(users)))
+
+    cmd = get_provision_cmd(missing, users, dirs)
+    result = yield session.stream(cmd, render_passwords(users), True)
+
+    if result.failed:
+        raise DeployException('Could not provision users on %s' % (session.host))
+
+    return missing
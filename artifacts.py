@@ -0,0 +1,145 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import urllib.request
+
+from fabric.api import env
+
+from facts import ARTIFACT_DIR
+from facts import get_facts
+from facts import save_facts
+from session import run, sudo
+from session import stream
+from data_structures import DeployException
+from plan import is_planning
+from plan import record
+
+
+# Local store functions
+# --------------------------------------------------------------------------
+def get_store_path(*parts):
+    return os.path.join(env.cache_dir, 'artifacts', *parts)
+
+def load_index():
+    path = get_store_path('index.json')
+
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as index_data:
+        return json.load(index_data)
+
+def save_index(index):
+    path = get_store_path('index.json')
+
+    with open(path + '.partial', 'w') as index_data:
+        json.dump(index, index_data, indent=4, sort_keys=True)
+
+    os.rename(path + '.partial', path)
+
+def hash_file(path):
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as file_data:
+        for chunk in iter(lambda: file_data.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def download(url, path):
+    print('[local] downloading %s' % (url))
+
+    with urllib.request.urlopen(url, timeout=60) as response:
+        with open(path, 'wb') as file_data:
+            shutil.copyfileobj(response, file_data)
+
+def fetch_artifact(url):
+    pinned = env.artifact_settings['hashes'].get(url)
+    store_path = get_store_path('store')
+
+    if not os.path.exists(store_path):
+        os.makedirs(store_path)
+
+    # Fleet hosts run in parallel processes, only one of them downloads
+    with open(get_store_path('index.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        index = load_index()
+        digest = pinned or index.get(url)
+
+        if digest and os.path.exists(get_store_path('store', digest)):
+            return digest
+
+        partial_path = get_store_path('store', 'download.partial')
+
+        try:
+            download(url, partial_path)
+            digest = hash_file(partial_path)
+
+            if pinned and digest != pinned:
+                raise DeployException('%s has sha256 %s, expected %s' % (url, digest, pinned))
+
+            os.rename(partial_path, get_store_path('store', digest))
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+        if not pinned:
+            print('[local] pin %s with sha256 %s' % (url, digest))
+
+        index[url] = digest
+        save_index(index)
+
+    return digest
+
+
+# Remote functions
+# --------------------------------------------------------------------------
+def upload_artifact(digest):
+    facts = get_facts()
+    remote = facts.setdefault('artifacts', [])
+    remote_path = os.path.join(ARTIFACT_DIR, digest)
+
+    if digest in remote:
+        return remote_path
+
+    print('[%s] uploading artifact %s' % (env.host_string, digest[:12]))
+
+    # Check the digest on the host too so a cut transfer never lands in the store
+    cmd = 'mkdir -p {0} && cat > {1}.partial && echo "{2}  {1}.partial" | sha256sum -c --quiet && mv {1}.partial {1}'.format(ARTIFACT_DIR, remote_path, digest)
+
+    with open(get_store_path('store', digest), 'rb') as artifact:
+        result = stream(cmd, source=artifact, use_sudo=True)
+
+    if result.failed:
+        raise DeployException('Could not upload artifact %s to %s' % (digest, env.host_string))
+
+    remote.append(digest)
+    save_facts(facts)
+
+    return remote_path
+
+def install_artifact(url, dest, use_sudo=False):
+    if is_planning():
+        record('artifact', '{} -> {}'.format(url, dest), 'root' if use_sudo else None)
+        return
+
+    digest = fetch_artifact(url)
+    remote_path = upload_artifact(digest)
+    cmd = 'cp {} {}'.format(remote_path, dest)
+
+    if use_sudo:
+        return sudo(cmd)
+
+    return run(cmd)
@@ -0,0 +1,73 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+from batch import get_script_cmd
+from facts import render_facts_script
+from facts import build_facts
+from facts import write_facts
+from facts import remove_facts
+from accounts import provision_users
+from services import install_ha_service
+from services import configure_mqtt as configure_mosquitto
+from engine import run_routine
+from data_structures import DeployException
+
+
+# Fact functions
+# --------------------------------------------------------------------------
+async def gather_facts(session):
+    services = session.config['facts']['services']
+    cmd = get_script_cmd(render_facts_script(services, [session.config['pyenv']['root']]))
+    result = await session.run(cmd, quiet=True)
+
+    if result.failed:
+        raise DeployException('Could not gather facts from %s' % (session.host))
+
+    facts = build_facts(result, session.address)
+    write_facts(facts, session.cache_dir)
+
+    return facts
+
+async def show_facts(session):
+    facts = await gather_facts(session)
+    services = ' '.join(['%s=%s' % (s, state) for s, state in sorted(facts['services'].items())])
+
+    print('[%s] %s, %d cpus, %s/%s MB available, %d packages, %s' % (session.host, facts['arch'], facts['nproc'],
+                                                                    facts['mem_available_mb'], facts['mem_total_mb'],
+                                                                    len(facts['packages']), services))
+
+
+# Host tasks
+# --------------------------------------------------------------------------
+# The routines are the ones the Fabric tasks run, only the fact cache is
+# handled here. Building and installing software (packages, pyenv, Home
+# Assistant, openzwave, libmicrohttpd, releases) stays on Fabric, those
+# tasks lean on cd(), prefix(), the local build caches and forked stages
+async def create_users(session):
+    user_info = session.config['user']
+    facts = await gather_facts(session)
+
+    try:
+        await run_routine(provision_users(session, user_info['accounts'], user_info['dirs'], facts))
+    finally:
+        remove_facts(session.address, session.cache_dir)
+
+async def install_service(session):
+    await run_routine(install_ha_service(session, session.config))
+
+async def configure_mqtt(session):
+    await run_routine(configure_mosquitto(session, session.config))
+
+
+# Task registry
+# --------------------------------------------------------------------------
+host_tasks = {  'show_facts':       show_facts,
+                'create_users':     create_users,
+                'install_service':  install_service,
+                'configure_mqtt':   configure_mqtt  }
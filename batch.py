@@ -0,0 +1,136 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import base64
+
+from fabric.api import env, hide, output
+
+from data_structures import DeployException
+from session import run, sudo
+from plan import is_planning
+from plan import record_command
+
+
+STATUS_MARKER = '__batch_status__'
+
+
+# Batch classes
+# --------------------------------------------------------------------------
+class BatchResult(object):
+
+    def __init__(self, command, return_code, output):
+        self.command = command
+        self.return_code = return_code
+        self.output = output
+        self.failed = return_code != 0
+        self.succeeded = not self.failed
+
+    def __repr__(self):
+        return 'BatchResult(%s, %s)' % (self.command, self.return_code)
+
+class CommandBatch(object):
+
+    def __init__(self, use_sudo=False, stop_on_error=False):
+        self.use_sudo = use_sudo
+        self.stop_on_error = stop_on_error
+        self.commands = []
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    @property
+    def failed(self):
+        return any([r.failed for r in self.results])
+
+    def add(self, cmd):
+        self.commands.append(cmd)
+
+    def execute(self):
+        if not self.commands:
+            return []
+
+        if is_planning():
+            op = 'sudo' if self.use_sudo else 'run'
+            self.results = [BatchResult(c, record_command(op, c).return_code, '') for c in self.commands]
+            return self.results
+
+        script = render_script(self.commands, self.stop_on_error)
+
+        if output.running:
+            label = 'sudo' if self.use_sudo else 'run'
+
+            for command in self.commands:
+                print('[%s] %s (batched): %s' % (env.host_string, label, command))
+
+        result = run_script(script, self.use_sudo)
+        self.results = parse_output(result, self.commands)
+
+        if len(self.results) < len(self.commands) and not self.stop_on_error:
+            raise DeployException('Batch did not report a status for every command')
+
+        return self.results
+
+
+# Script functions
+# --------------------------------------------------------------------------
+def get_script_cmd(script):
+    encoded = base64.b64encode(script.encode('utf-8')).decode('ascii')
+
+    # Decode to a temp file rather than piping into sh so commands
+    # that read stdin do not swallow the rest of the script
+    return 'f=$(mktemp) && echo {} | base64 -d > $f; sh $f; rc=$?; rm -f $f; exit $rc'.format(encoded)
+
+def run_script(script, use_sudo=False):
+    cmd = get_script_cmd(script)
+
+    with hide('running'):
+        if use_sudo:
+            return sudo(cmd)
+
+        return run(cmd)
+
+def render_script(commands, stop_on_error=False):
+    lines = ['__batch_rc=0']
+
+    for index, command in enumerate(commands):
+        lines.append('{')
+        lines.append(command)
+        lines.append('}')
+        lines.append('__rc=$?')
+        lines.append('echo "%s %d $__rc"' % (STATUS_MARKER, index))
+
+        if stop_on_error:
+            lines.append('[ $__rc -eq 0 ] || exit $__rc')
+        else:
+            lines.append('[ $__rc -eq 0 ] || __batch_rc=$__rc')
+
+    lines.append('exit $__batch_rc')
+
+    return '\n'.join(lines) + '\n'
+
+def parse_output(result, commands):
+    results = []
+    buffered = []
+
+    for line in result.splitlines():
+        tokens = line.strip().split()
+
+        if len(tokens) == 3 and tokens[0] == STATUS_MARKER:
+            command = commands[int(tokens[1])]
+            results.append(BatchResult(command, int(tokens[2]), '\n'.join(buffered)))
+            buffered = []
+        else:
+            buffered.append(line)
+
+    return results
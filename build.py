@@ -0,0 +1,165 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import json
+import time
+import fcntl
+from contextlib import contextmanager
+
+from fabric.api import env, prefix
+
+from facts import get_facts
+from session import run, sudo
+from plan import is_planning
+
+
+prepared_hosts = []
+
+
+# Build environment
+# --------------------------------------------------------------------------
+def get_build_jobs(facts, job_memory_mb):
+    # Compiling C++ on a Pi runs out of memory long before it runs out
+    # of cores, so the job count is capped by both
+    by_memory = facts.get('mem_available_mb', 0) // job_memory_mb
+
+    return max(1, min(facts['nproc'], by_memory))
+
+def get_build_prefix(use_sudo=False):
+    settings = env.build_settings
+    jobs = get_build_jobs(get_facts(), settings['job_memory_mb'])
+
+    exports = [ 'export CCACHE_MAXSIZE={}'.format(settings['ccache_max_size']),
+                'export PATH=/usr/lib/ccache:$PATH',
+                'export MAKEFLAGS=-j{}'.format(jobs),
+                'export MAKE_OPTS=-j{}'.format(jobs) ]
+
+    # Objects from the cache end up in binaries installed as root, so root
+    # builds use a cache only root can write and every other user keeps
+    # ccache's default cache in their own home
+    if use_sudo:
+        exports.insert(0, 'export CCACHE_DIR={}'.format(settings['ccache_dir']))
+
+    return '; '.join(exports)
+
+def prepare_ccache():
+    if env.host_string in prepared_hosts:
+        return
+
+    # A cache left world writable by an earlier deploy cannot be trusted
+    # and starts over
+    settings = env.build_settings
+    cmd = '{{ [ -z "$(find {0} -maxdepth 0 -perm -0002 2>/dev/null)" ] || rm -rf {0}; }}'.format(settings['ccache_dir'])
+    cmd += ' && mkdir -p {0} && chown root:root {0} && chmod 0755 {0}'.format(settings['ccache_dir'])
+    sudo(cmd)
+
+    prepared_hosts.append(env.host_string)
+
+
+# Build stats
+# --------------------------------------------------------------------------
+def parse_ccache_stats(result):
+    stats = {'hits': 0, 'misses': 0}
+    seen = []
+
+    for line in result.splitlines():
+        line = line.strip()
+        tokens = line.split()
+
+        # ccache 3 prints 'cache hit (direct)  12', ccache 4 'Hits: 12 / 20'
+        # once for the totals and again per storage backend
+        try:
+            if line.startswith('cache hit'):
+                stats['hits'] += int(tokens[-1])
+            elif line.startswith('cache miss'):
+                stats['misses'] += int(tokens[-1])
+            elif line.startswith('Hits:') and 'hits' not in seen:
+                stats['hits'] += int(tokens[1])
+                seen.append('hits')
+            elif line.startswith('Misses:') and 'misses' not in seen:
+                stats['misses'] += int(tokens[1])
+                seen.append('misses')
+        except (IndexError, ValueError):
+            continue
+
+    return stats
+
+def get_ccache_stats(use_sudo=False):
+    if use_sudo:
+        result = sudo('ccache -s', quiet=True)
+    else:
+        result = run('ccache -s', quiet=True)
+
+    return parse_ccache_stats(result)
+
+def record_build(stats):
+    path = os.path.join(env.cache_dir, 'builds', '%s.jsonl' % (env.host))
+
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    with open(path, 'a') as stats_data:
+        stats_data.write(json.dumps(stats, sort_keys=True) + '\n')
+
+@contextmanager
+def build_lock():
+    # The job count is sized for the whole host, parallel stages and fleet
+    # processes take turns so two builds never stack on one Pi
+    path = os.path.join(env.cache_dir, 'builds', '%s.lock' % (env.host))
+
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    with open(path, 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            print('[%s] waiting for another build to finish' % (env.host_string))
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+        yield
+
+def timed_build(name, cmd, use_sudo=False):
+    prepare_ccache()
+
+    if is_planning():
+        with prefix(get_build_prefix(use_sudo)):
+            return sudo(cmd) if use_sudo else run(cmd)
+
+    with build_lock(), prefix(get_build_prefix(use_sudo)):
+        before = get_ccache_stats(use_sudo)
+        start = time.time()
+
+        if use_sudo:
+            result = sudo(cmd, tail=True)
+        else:
+            result = run(cmd, tail=True)
+
+        elapsed = time.time() - start
+        after = get_ccache_stats(use_sudo)
+
+    hits = after['hits'] - before['hits']
+    misses = after['misses'] - before['misses']
+    total = hits + misses
+    hit_rate = float(hits) / total if total else 0.0
+
+    stats = {   'name':         name,
+                'host':         env.host,
+                'started_at':   start,
+                'elapsed':      elapsed,
+                'succeeded':    result.succeeded,
+                'cache_hits':   hits,
+                'cache_misses': misses,
+                'hit_rate':     hit_rate    }
+
+    record_build(stats)
+    print('[%s] build %s took %.1fs, ccache %d hits / %d misses (%.0f%%)' % (env.host_string, name, elapsed, hits, misses, hit_rate * 100))
+
+    return result
@@ -0,0 +1,122 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import gzip
+import time
+from contextlib import contextmanager
+
+from fabric.api import env
+from fabric.network import normalize
+
+from tracing import get_current_task
+
+
+# Log files
+# --------------------------------------------------------------------------
+def is_enabled():
+    return env.get('capture_settings', {}).get('enable', False)
+
+def get_log_path():
+    host = normalize(env.host_string)[1] if env.host_string else 'local'
+    task = get_current_task() or 'commands'
+
+    return os.path.join(env.cache_dir, 'logs', env.deploy_id, host, '%s.log.gz' % (task))
+
+class LogStream(object):
+    def __init__(self, log, name):
+        self.log = log
+        self.prefix = '[%s] %s: ' % (env.host_string, name)
+        self.size = 0
+
+    def write(self, text):
+        # The capture buffer only keeps the tail, so the trace takes its
+        # sizes from what went past here. Fabric writes each line prefix
+        # on its own, it is not part of the output
+        if text != self.prefix:
+            self.size += len(text.encode('utf-8', 'replace'))
+
+        self.log.write(text)
+
+    def flush(self):
+        pass
+
+class CommandLog(object):
+    def __init__(self, path):
+        self.path = path
+        self.log = gzip.open(path, 'at', encoding='utf-8', errors='replace')
+        self.stdout = LogStream(self, 'out')
+        self.stderr = LogStream(self, 'err')
+
+    def write(self, text):
+        self.log.write(text)
+
+    def flush(self):
+        # Fabric flushes after every chunk, a sync flush that often would
+        # ruin the compression
+        pass
+
+    def finish(self, result):
+        self.log.write('\n[exit %s]\n\n' % (getattr(result, 'return_code', None)))
+
+    def close(self):
+        self.log.close()
+
+class NullLog(object):
+    path = None
+    stdout = None
+    stderr = None
+
+    def finish(self, result):
+        pass
+
+@contextmanager
+def capture_output(cmd, kwargs, tail=False):
+    # Quiet commands print nothing and callers that pass their own
+    # streams keep them
+    if not is_enabled() or kwargs.get('quiet') or 'stdout' in kwargs:
+        yield NullLog()
+        return
+
+    path = get_log_path()
+
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    # Each command appends its own gzip member, so forked stages and
+    # fleet hosts never leave a half written stream behind
+    log = CommandLog(path)
+    log.write('$ %s  # %s\n' % (cmd, time.strftime('%H:%M:%S')))
+
+    kwargs['stdout'] = log.stdout
+    kwargs['stderr'] = log.stderr
+
+    if tail:
+        kwargs['capture_buffer_size'] = env.capture_settings['buffer_size']
+
+    try:
+        yield log
+    finally:
+        log.close()
+
+
+# Failure reports
+# --------------------------------------------------------------------------
+def print_tail(result, log):
+    if log.path is None or not result.failed:
+        return
+
+    lines = result.splitlines()[-env.capture_settings['tail_lines']:]
+
+    print('[%s] command failed (%s), last %d lines:' % (env.host_string, result.return_code, len(lines)))
+
+    for line in lines:
+        print('[%s]     %s' % (env.host_string, line))
+
+    print('[%s] full output in %s' % (env.host_string, log.path))
@@ -11,7 +11,8 @@ import json
 
 from data_structures import User
 from data_structures import MosquittoUser
-from helper import get_passwords
+from vault import lazy_secret
+from vault import configure_vault
 
 # Read config json
 config = None
@@ -19,15 +20,16 @@ config_file = 'config.json'
 with open(config_file) as config_data:    
     config = json.load(config_data)
 
+configure_vault(config['secrets'])
+
 # Create users
 users = []
 
 for raw_user in config['user']['accounts']:
-    user = User(raw_user['name'], raw_user['ha_user'], raw_user['admin_user'])
+    secret = lazy_secret('user.%s' % (raw_user['name']))
+    user = User(raw_user['name'], raw_user['ha_user'], raw_user['admin_user'], secret)
     users.append(user)
 
-get_passwords(users)
-
 config['user']['accounts'] = users
 
 
@@ -35,9 +37,7 @@ config['user']['accounts'] = users
 users = []
 
 for raw_name in config['mqtt']['users']:
-    user = MosquittoUser(raw_name)
+    user = MosquittoUser(raw_name, lazy_secret('mqtt.%s' % (raw_name)))
     users.append(user)
 
-get_passwords(users)
-
 config['mqtt']['users'] = users
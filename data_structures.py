@@ -9,11 +9,12 @@
 
 class User(object):
 
-    def __init__(self, name, home_assistant_user, admin_user):
+    def __init__(self, name, home_assistant_user, admin_user, resolve_password=None):
         self.name = name
         self.home_assistant_user = home_assistant_user
         self.admin_user = admin_user
-        self.password = None
+        self.resolve_password = resolve_password
+        self._password = None
 
         if self.home_assistant_user:
             self.admin_user = False
@@ -21,6 +22,18 @@ class User(object):
         if self.admin_user:
             self.home_assistant_user = False
 
+    @property
+    def password(self):
+        # Resolved on first use, so listing or planning never prompts
+        if self._password is None and self.resolve_password:
+            return self.resolve_password()
+
+        return self._password
+
+    @password.setter
+    def password(self, value):
+        self._password = value
+
     def __repr__(self):
         return 'User(%s, %s, %s)' % (self.name, self.home_assistant_user, self.admin_user)
 
@@ -29,9 +42,21 @@ class User(object):
 
 class MosquittoUser(object):
 
-    def __init__(self, name):
+    def __init__(self, name, resolve_password=None):
         self.name = name
-        self.password = None
+        self.resolve_password = resolve_password
+        self._password = None
+
+    @property
+    def password(self):
+        if self._password is None and self.resolve_password:
+            return self.resolve_password()
+
+        return self._password
+
+    @password.setter
+    def password(self, value):
+        self._password = value
 
 class DeployException(Exception):
     pass
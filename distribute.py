@@ -0,0 +1,231 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import math
+import time
+
+from fabric.api import env, execute, parallel, settings
+from fabric.network import normalize
+
+from facts import get_facts
+from fleet import run_on_fleet
+from session import run, sudo
+
+
+COMPONENT_DIR   = '/var/cache/ha_deploy/components'
+RELAY_TIMEOUT   = 900
+
+prepared_hosts = []
+
+
+# Component functions
+# --------------------------------------------------------------------------
+def prepare_component_dir():
+    if env.host_string in prepared_hosts:
+        return
+
+    # Archives and their checksums sit side by side and end up in a root
+    # install, only root may write here. A directory left world writable
+    # by an earlier deploy cannot be trusted and starts over
+    cmd = '{{ [ -z "$(find {0} -maxdepth 0 -perm -0002 2>/dev/null)" ] || rm -rf {0}; }}'.format(COMPONENT_DIR)
+    cmd += ' && mkdir -p {0} && chown root:root {0} && chmod 0755 {0}'.format(COMPONENT_DIR)
+    sudo(cmd)
+
+    prepared_hosts.append(env.host_string)
+
+def get_component_file(name):
+    # The fingerprint of the running task covers everything the build
+    # depends on, so a changed input never picks up an old artifact
+    arch = get_facts()['arch']
+
+    return '{}-{}-{}.tar.gz'.format(name, arch, env.fingerprint[:12])
+
+def unpack_component(name, dest):
+    # Archives are unpacked and installed as root, only one that matches
+    # the checksum recorded on the build host is trusted
+    component_file = get_component_file(name)
+    cmd = 'cd {0} && test -f {1} && sha256sum -c --quiet {1}.sha256 && tar xzf {1} -C {2}'.format(COMPONENT_DIR, component_file, dest)
+    result = run(cmd, quiet=True)
+
+    if result.succeeded:
+        print('[%s] installed prebuilt %s' % (env.host_string, name))
+
+    return result.succeeded
+
+def pack_component(name, src, paths):
+    prepare_component_dir()
+
+    arch = get_facts()['arch']
+    path = os.path.join(COMPONENT_DIR, get_component_file(name))
+    stale = os.path.join(COMPONENT_DIR, '{}-{}-*.tar.gz*'.format(name, arch))
+    cmd = 'rm -f {0} && tar czf {1}.partial -C {2} {3} && mv {1}.partial {1}'.format(stale, path, src, ' '.join(paths))
+    cmd += ' && cd {} && sha256sum {} > {}.sha256'.format(COMPONENT_DIR, os.path.basename(path), path)
+
+    return sudo(cmd)
+
+def list_components():
+    cmd = 'ls {} 2>/dev/null'.format(COMPONENT_DIR)
+    result = run(cmd, quiet=True)
+
+    return [name for name in result.split() if name.endswith('.tar.gz')]
+
+def get_component_hashes():
+    cmd = 'cat {}/*.tar.gz.sha256 2>/dev/null; true'.format(COMPONENT_DIR)
+    result = run(cmd, quiet=True)
+    hashes = {}
+
+    for line in result.splitlines():
+        tokens = line.split()
+
+        if len(tokens) == 2 and tokens[1].endswith('.tar.gz'):
+            hashes[tokens[1]] = tokens[0]
+
+    return hashes
+
+
+# Relay functions
+# --------------------------------------------------------------------------
+def get_address(host_string):
+    return normalize(host_string)[1]
+
+def get_firewall_cmd(action, address, port):
+    # The relay port is only open to the one host fetching, and only for
+    # the length of the relay
+    rule = 'allow from {} to any port {} proto tcp'.format(address, port)
+
+    if action == 'close':
+        rule = 'delete ' + rule
+
+    return '! command -v ufw > /dev/null || ufw {}'.format(rule)
+
+def relay_components(sources, files, port):
+    source = sources[env.host_string]
+    address = get_address(source)
+    target = get_address(env.host_string)
+
+    with settings(host_string=source):
+        sudo(get_firewall_cmd('open', target, port), quiet=True)
+        cmd = 'cd {} && {{ nohup timeout {} python3 -m http.server {} < /dev/null > /dev/null 2>&1 & echo $!; }}'.format(COMPONENT_DIR, RELAY_TIMEOUT, port)
+        server = run(cmd, pty=False)
+
+    try:
+        prepare_component_dir()
+        cmds = []
+
+        # The server is unauthenticated, each archive is checked against
+        # the hash read from the build host over ssh before it is kept
+        for name, digest in sorted(files.items()):
+            path = os.path.join(COMPONENT_DIR, name)
+            url = 'http://{}:{}/{}'.format(address, port, name)
+            check = 'echo "{}  {}.partial" | sha256sum -c --quiet'.format(digest, path)
+            fetch = 'wget -q -t 5 --retry-connrefused -O {0}.partial {1} && {2} && mv {0}.partial {0} || {{ rm -f {0}.partial; false; }}'.format(path, url, check)
+            held = 'echo "{}  {}" | sha256sum -c --quiet > /dev/null 2>&1'.format(digest, path)
+            cmds.append('{{ {{ {} || {{ {}; }}; }} && echo "{}  {}" > {}.sha256; }}'.format(held, fetch, digest, name, path))
+
+        result = sudo(' && '.join(cmds))
+    finally:
+        with settings(host_string=source):
+            run('kill {}'.format(server.strip()), quiet=True)
+            sudo(get_firewall_cmd('close', target, port), quiet=True)
+
+    return result.succeeded
+
+def distribute_components(build_host, files, targets, concurrency, port):
+    holders = [build_host]
+    pending = []
+
+    have = execute(parallel(pool_size=concurrency)(list_components), hosts=targets)
+
+    for host in targets:
+        if isinstance(have.get(host), list) and set(files) <= set(have[host]):
+            holders.append(host)
+        else:
+            pending.append(host)
+
+    # Every round doubles the hosts that can serve, allow a couple of
+    # extra rounds to retry relays that failed
+    rounds = int(math.ceil(math.log(len(targets) + 1, 2))) + 2
+
+    for index in range(rounds):
+        if not pending:
+            break
+
+        sources = dict(zip(pending, holders))
+        start = time.time()
+        task = parallel(pool_size=concurrency)(relay_components)
+        results = execute(task, sources, files, port, hosts=list(sources))
+
+        for host in sources:
+            if results.get(host) is True:
+                pending.remove(host)
+                holders.append(host)
+
+        print('[relay] round %d sent to %d hosts in %.1fs, %d hosts hold the builds, %d waiting' % (index + 1, len(sources), time.time() - start, len(holders), len(pending)))
+
+    return pending
+
+
+# Fleet functions
+# --------------------------------------------------------------------------
+def get_arch():
+    return get_facts()['arch']
+
+def build_and_distribute(tasks, hosts, concurrency, config, overrides):
+    distribute = config['distribute']
+    archs = execute(parallel(pool_size=concurrency)(get_arch), hosts=hosts)
+    groups = {}
+    results = {}
+
+    for host in hosts:
+        groups.setdefault(archs.get(host), []).append(host)
+
+    def build_components():
+        for task in tasks:
+            task()
+
+    build_components.__name__ = 'build_components'
+
+    for arch, group in sorted(groups.items(), key=lambda item: str(item[0])):
+        build_host = distribute['build_hosts'].get(arch)
+
+        if build_host not in group:
+            build_host = group[0]
+
+        targets = [host for host in group if host != build_host]
+        print('[relay] building %s components on %s for %d hosts' % (arch, build_host, len(group)))
+
+        results.update(run_on_fleet(build_components, [build_host], 1, config, overrides))
+
+        if results[build_host]['status'] != 'ok':
+            for host in targets:
+                results[host] = {'status': 'skipped', 'elapsed': 0.0, 'error': 'build failed on %s' % (build_host)}
+
+            continue
+
+        files = execute(get_component_hashes, hosts=[build_host])[build_host]
+
+        # Up to date markers can skip every build, then there is nothing
+        # to relay and each host builds, or skips, on its own
+        if not files:
+            print('[relay] %s has no prebuilt components, building on each host' % (build_host))
+            results.update(run_on_fleet(build_components, targets, concurrency, config, overrides))
+            continue
+
+        start = time.time()
+        failed = distribute_components(build_host, files, targets, concurrency, distribute['port'])
+        elapsed = time.time() - start
+
+        for host in targets:
+            if host in failed:
+                results[host] = {'status': 'failed', 'elapsed': elapsed, 'error': 'relay failed, the host will build locally'}
+            else:
+                results[host] = {'status': 'ok', 'elapsed': elapsed, 'error': ''}
+
+    return results
@@ -0,0 +1,342 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import io
+import abc
+import copy
+import time
+import shlex
+import asyncio
+import concurrent.futures
+
+import paramiko
+from fabric.network import normalize
+from fabric.operations import _AttributeString
+
+from session import READY_MARKER
+from session import CHUNK_SIZE
+from session import wait_until_ready
+from session import drain
+from fleet import apply_overrides
+from data_structures import DeployException
+
+
+SUDO_PROMPT = '[engine] sudo password:'
+TAIL_LINES  = 20
+
+
+# Result functions
+# --------------------------------------------------------------------------
+def make_result(stdout, stderr, return_code):
+    result = _AttributeString(stdout.decode('utf-8', 'replace').rstrip())
+    result.stderr = stderr.decode('utf-8', 'replace').rstrip()
+    result.return_code = return_code
+    result.failed = return_code != 0
+    result.succeeded = not result.failed
+
+    return result
+
+def get_tail(result):
+    lines = (result.stderr or result).splitlines()
+
+    return '\n'.join(lines[-TAIL_LINES:])
+
+async def wait_for_marker(process, password, user):
+    buffered = b''
+    prompt = SUDO_PROMPT.encode('utf-8')
+    marker = READY_MARKER.encode('utf-8')
+    prompted = False
+
+    # Same handshake as session.stream, sudo has authenticated once the
+    # command echoes the marker
+    while marker not in buffered:
+        data = await process.stderr.read(CHUNK_SIZE)
+
+        if not data:
+            return False, buffered
+
+        buffered += data
+
+        if prompt in buffered and marker not in buffered:
+            if prompted:
+                raise DeployException('sudo rejected the password for %s' % (user))
+
+            process.stdin.write((password or '').encode('utf-8') + b'\n')
+            await process.stdin.drain()
+            buffered = buffered.replace(prompt, b'')
+            prompted = True
+
+    return True, buffered.replace(marker + b'\n', b'', 1)
+
+
+# Backends
+# --------------------------------------------------------------------------
+class Backend(abc.ABC):
+
+    def __init__(self, host):
+        self.host = host
+
+    @abc.abstractmethod
+    async def execute(self, command, source=None, password=None, user=None):
+        pass
+
+    async def close(self):
+        pass
+
+class SSHBackend(Backend):
+
+    def __init__(self, host, user, password, executor, timeout):
+        Backend.__init__(self, host)
+        self.user = user
+        self.password = password
+        self.executor = executor
+        self.timeout = timeout
+        self.client = None
+
+    def connect(self):
+        user, address, port = normalize(self.host)
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+        if '@' not in self.host:
+            user = self.user
+
+        client.connect(address, int(port), username=user, password=self.password, timeout=self.timeout)
+
+        return client
+
+    def execute_blocking(self, command, source, password, user):
+        # Paramiko blocks, so each command runs on an executor thread and
+        # one connection per host is reused for every command
+        if self.client is None:
+            self.client = self.connect()
+
+        channel = self.client.get_transport().open_session()
+        channel.exec_command(command)
+        sink = io.BytesIO()
+        ready, buffered = wait_until_ready(channel, SUDO_PROMPT, password, user)
+        errors = [buffered.encode('utf-8')]
+
+        if ready:
+            source = io.BytesIO(source or b'')
+
+            while True:
+                drain(channel, sink, errors)
+                data = source.read(CHUNK_SIZE)
+
+                if not data:
+                    break
+
+                channel.sendall(data)
+
+            channel.shutdown_write()
+
+            while not channel.exit_status_ready() or channel.recv_ready() or channel.recv_stderr_ready():
+                if not any(drain(channel, sink, errors)):
+                    time.sleep(0.01)
+
+        return_code = channel.recv_exit_status()
+        channel.close()
+
+        return make_result(sink.getvalue(), b''.join(errors), return_code)
+
+    async def execute(self, command, source=None, password=None, user=None):
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(self.executor, self.execute_blocking, command, source, password, user)
+
+    async def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+class LocalBackend(Backend):
+
+    def __init__(self, host, container, runtime='docker'):
+        Backend.__init__(self, host)
+
+        # Tasks write to /etc and run useradd, they must never land on the
+        # control host itself
+        if not container:
+            raise DeployException('No container for %s in engine.containers' % (host))
+
+        self.container = container
+        self.runtime = runtime
+
+    def get_args(self, command):
+        return [self.runtime, 'exec', '-i', self.container, '/bin/sh', '-c', command]
+
+    async def execute(self, command, source=None, password=None, user=None):
+        process = await asyncio.create_subprocess_exec(*self.get_args(command),
+                                                       stdin=asyncio.subprocess.PIPE,
+                                                       stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.PIPE)
+
+        ready, buffered = await wait_for_marker(process, password, user)
+        stdout, stderr = await process.communicate(source if ready else None)
+
+        return make_result(stdout, buffered + stderr, process.returncode)
+
+
+# Sessions
+# --------------------------------------------------------------------------
+class HostSession(object):
+    # The engine runs paramiko and executor threads, a forked child could
+    # hang on a lock one of them held
+    can_fork = False
+
+    def __init__(self, host, backend, user, password, config):
+        self.host = host
+        self.address = normalize(host)[1]
+        self.backend = backend
+        self.login = user
+        self.user = user
+        self.password = password
+        self.config = config
+        self.cache_dir = config['cache']['dir']
+
+    def as_user(self, user):
+        # Other users are reached through sudo -u on the login connection,
+        # nothing global changes so hosts never see each other's user
+        session = copy.copy(self)
+        session.user = user
+
+        return session
+
+    def wrap(self, cmd, use_sudo, user):
+        command = '/bin/sh -c {}'.format(shlex.quote('echo {} >&2; {}'.format(READY_MARKER, cmd)))
+
+        if not use_sudo:
+            return command
+
+        sudo_prefix = "sudo -S -H -p '{}'".format(SUDO_PROMPT)
+
+        if user:
+            sudo_prefix += ' -u {}'.format(user)
+
+        return '{} {}'.format(sudo_prefix, command)
+
+    async def execute(self, cmd, use_sudo=False, user=None, source=None, quiet=False, label=None):
+        if not use_sudo and self.user != self.login:
+            use_sudo = True
+            user = self.user
+
+        label = label or ('sudo' if use_sudo else 'run')
+
+        if not quiet:
+            print('[%s] %s: %s' % (self.host, label, cmd))
+
+        command = self.wrap(cmd, use_sudo, user)
+        result = await self.backend.execute(command, source, self.password, self.login)
+
+        if result.failed and not quiet:
+            print('[%s] %s failed (%d):\n%s' % (self.host, label, result.return_code, get_tail(result)))
+
+        return result
+
+    async def run(self, cmd, quiet=False, source=None):
+        return await self.execute(cmd, source=source, quiet=quiet)
+
+    async def sudo(self, cmd, user=None, quiet=False, source=None):
+        return await self.execute(cmd, True, user, source, quiet)
+
+    async def put(self, content, remote_path, use_sudo=False, mode=None):
+        cmd = 'cat > {}'.format(remote_path)
+
+        if mode:
+            cmd += ' && chmod {} {}'.format(mode, remote_path)
+
+        return await self.execute(cmd, use_sudo, source=content, label='put')
+
+    async def stream(self, cmd, source=None, use_sudo=False):
+        return await self.execute(cmd, use_sudo, source=source, label='stream')
+
+    async def call(self, func, *args):
+        # Hashing and delta building are CPU bound, keep them off the loop so
+        # the other hosts keep moving
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(None, func, *args)
+
+    async def close(self):
+        await self.backend.close()
+
+
+# Runner functions
+# --------------------------------------------------------------------------
+async def run_routine(routine):
+    # Same routines as the Fabric tasks, each yielded call is awaited here
+    try:
+        step = routine.send(None)
+
+        while True:
+            try:
+                result = await step
+            except Exception as e:
+                step = routine.throw(e)
+                continue
+
+            step = routine.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+def get_backend(host, settings, user, password, executor):
+    backend = settings['backend']
+
+    if backend == 'ssh':
+        return SSHBackend(host, user, password, executor, settings['connect_timeout'])
+
+    if backend == 'local':
+        return LocalBackend(host, settings['containers'].get(host), settings['runtime'])
+
+    raise DeployException('Unknown engine backend: %s' % (backend))
+
+async def run_host(func, host, semaphore, open_session):
+    async with semaphore:
+        start = time.time()
+        session = None
+
+        try:
+            session = open_session(host)
+            await func(session)
+            status = 'ok'
+            error = ''
+        except Exception as e:
+            status = 'failed'
+            error = str(e) or e.__class__.__name__
+        finally:
+            if session is not None:
+                await session.close()
+
+    return host, {'status': status, 'elapsed': time.time() - start, 'error': error}
+
+async def run_hosts(func, hosts, concurrency, open_session):
+    semaphore = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(*[run_host(func, host, semaphore, open_session) for host in hosts])
+
+    return dict(results)
+
+def run_engine(func, hosts, concurrency, config, overrides, user, password):
+    settings = config['engine']
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+
+    def open_session(host):
+        # Each host works on its own copy of the config, the forked fleet
+        # runs get the same isolation from their process
+        host_config = copy.deepcopy(config)
+        apply_overrides(host_config, overrides.get(host, {}))
+        backend = get_backend(host, settings, user, password, executor)
+
+        return HostSession(host, backend, user, password, host_config)
+
+    try:
+        return asyncio.run(run_hosts(func, hosts, concurrency, open_session))
+    finally:
+        executor.shutdown()
@@ -7,21 +7,80 @@
 # --------------------------------------|~~~~~~~~|--------------------------------------
 
 import os
+import time
 
 import fabric
-from fabric.api import local, env, run, task, prefix, sudo, cd
-from fabric.operations import put
+from fabric.api import local, env, prefix, cd, runs_once
 
 from config import config
 from data_structures import DeployException
 from data_structures import User
 from helper import install_native
 from helper import get_user_home_dir
+from helper import get_append_cmd
 from helper import get_mosquitto_user
 
 from helper import switch_user
 from helper import get_ha_user
 from helper import get_admin_user
+from git_mirror import sync_repo
+from artifacts import install_artifact
+from distribute import pack_component
+from distribute import unpack_component
+from distribute import build_and_distribute
+from images import IMAGE_MARKER
+from images import has_image
+from images import get_image_name
+from images import provision_from_image
+from releases import get_release_name
+from releases import get_release_path
+from releases import get_active_release
+from releases import seed_release
+from releases import activate_release
+from releases import rollback_release
+from releases import is_active
+from releases import prune_releases
+from readiness import get_probes
+from readiness import wait_for_services
+from build import timed_build
+from wheelhouse import pip_install
+from pyenv_cache import install_interpreter
+from fingerprint import incremental
+from packages import plan_packages
+from facts import get_facts
+from facts import facts_cache
+from facts import invalidate_facts
+from session import run, sudo
+from tracing import task
+from vault import prompt_secret
+from vault import set_secret as store_secret
+from vault import get_secret_source
+from vault import resolve_secrets
+from vault import lazy_secret
+from session import print_pool_stats
+from session import fabric_session
+from session import run_routine
+from batch import CommandBatch
+from scheduler import requires
+from scheduler import run_stages
+from scheduler import get_stage_order
+from scheduler import print_stage_summary
+from fleet import get_fleet_hosts
+from fleet import apply_env_settings
+from fleet import run_on_fleet
+from fleet import run_rolling
+from fleet import print_summary
+from plan import plan_task
+from engine import run_engine
+from async_tasks import host_tasks
+from accounts import provision_users
+from managed_files import install_delta_helper
+from managed_files import get_file_values
+from managed_files import sync_files
+from services import install_ha_service
+from services import configure_mqtt
+from ha_config import sync_config
+from ha_config import reload_config
 
 from   fabric.api import output
 
@@ -57,60 +116,97 @@ env.hosts = [config['system']['hostname']]
 env.shell = "/bin/sh -c"
 env.warn_only = True
 env.use_ssh_config = False
+env.deploy_id = time.strftime('%Y%m%d-%H%M%S')
 
+apply_env_settings(config)
 switch_user(install_user, install_password)
 
 
 # Setup functions
 # --------------------------------------------------------------------------
+def load_secrets():
+    resolve_secrets(config['user']['accounts'] + config['mqtt']['users'])
+
+def sync_managed_files(*names):
+    return run_routine(sync_files(fabric_session, names, get_file_values(config), config['managed_files']))
+
+@task
+def force():
+    # Run the following tasks even when their inputs are unchanged
+    env.force = True
+
+@task
+@requires('create_users')
+@incremental(config, sections=['mqtt'])
+def add_mqtt_repo():
+    user_info               = config['user']
+    admin_user              = get_admin_user(user_info)
+    mqtt                    = config['mqtt']
+    app_dir                 = mqtt['dir']
+    gpg_key_url             = mqtt['gpg_key_url']
+    apt_list_url            = mqtt['apt_list_url']
+    apt_list                = os.path.basename(apt_list_url)
+
+    if apt_list in get_facts()['apt_sources']:
+        return
+
+    switch_user(admin_user.name, admin_user.password)
+
+    app_path = os.path.join('/opt', app_dir)
+    cmd = 'mkdir -p {}'.format(app_path)
+    sudo(cmd)
+
+    gpg_key_path = os.path.join(app_path, os.path.basename(gpg_key_url))
+    install_artifact(gpg_key_url, gpg_key_path, use_sudo=True)
+    sudo('apt-key add {}'.format(gpg_key_path))
+
+    apt_list_path = os.path.join('/etc/apt/sources.list.d/', apt_list)
+    install_artifact(apt_list_url, apt_list_path, use_sudo=True)
+
+    # The new source is only visible to apt after an update
+    get_facts()['apt_sources'].append(apt_list)
+    install_native([], update=True)
+
+@task
+@requires('add_mqtt_repo')
+@incremental(config, sections=['system_apps', 'python_system_libs', 'openzwave', 'libmicrohttpd', 'mqtt', 'firewall', 'build'])
+def install_packages():
+    switch_user(install_user, install_password)
+    install_native(plan_packages(config))
+
 @task
+@requires('install_packages')
+@incremental(config, sections=['system_apps'])
 def install_system_apps():
     system_apps = config['system_apps']
     switch_user(install_user, install_password)
     install_native(system_apps)
 
 @task
+@requires('install_packages')
+@incremental(config, sections=['python_system_libs'])
 def install_python_libs():
     python_system_libs = config['python_system_libs']
     switch_user(install_user, install_password)
     install_native(python_system_libs)
 
 @task
+@incremental(config, sections=['user'])
 def create_users():
     user_info   = config['user']
     users       = user_info['accounts']
     dirs        = user_info['dirs']
 
-    for user in users:
-        switch_user(install_user, install_password)
-        create_user(user)
-
-        if not user.home_assistant_user:
-            switch_user(user.name, user.password)
-            create_user_dirs(user, dirs)
-
-def create_user(user):
-    if user.home_assistant_user:
-        cmd = 'useradd -m -r %s' % (user.name)
-        sudo(cmd)
-    else:
-        cmd = 'useradd -m %s -G sudo' % (user.name)
-        sudo(cmd)
-
-    cmd = 'echo "%s:%s" | sudo chpasswd' % (user.name, user.password)
-    sudo(cmd)
-
-def create_user_dirs(user, user_dirs):
-    for dir in user_dirs:
-        path = '/home/%s/%s' % (user.name, dir)
-        cmd = 'mkdir -p %s' % path
-        sudo(cmd)
+    switch_user(install_user, install_password)
 
-    user_home = path = '/home/%s' % (user.name)
-    cmd = 'chown -R %s:%s %s' % (user.name, user.name, user_home)
-    sudo(cmd)
+    try:
+        run_routine(provision_users(fabric_session, users, dirs, get_facts()))
+    finally:
+        invalidate_facts()
 
 @task
+@requires('create_users')
+@incremental(config, sections=['user'])
 def create_all_aliases():
     users       = config['user']['accounts']
 
@@ -122,19 +218,18 @@ def create_user_alias(user):
     home_path   = get_user_home_dir(user.name)
     bashrc = os.path.join(home_path, '.bashrc')
 
-    cmd = """echo '' >> {}""".format(bashrc)
-    run(cmd)
-
-    cmd = """echo '# Aliases >> {}""".format(bashrc)
-    run(cmd)
+    with CommandBatch() as batch:
+        cmd = get_append_cmd('# Aliases', bashrc)
+        batch.add(cmd)
 
-    cmd = """echo "alias ll='ls -l'" >> {}""".format(bashrc)
-    run(cmd)
+        cmd = get_append_cmd("alias ll='ls -l'", bashrc)
+        batch.add(cmd)
 
-    cmd = """echo "alias la='ls -la'" >> {}""".format(bashrc)
-    run(cmd)
+        cmd = get_append_cmd("alias la='ls -la'", bashrc)
+        batch.add(cmd)
 
 @task
+@incremental(config)
 def cleanup_opt():
     unwanted_apps = ['minecraft-pi', 'sonic-pi', 'Wolfram']
     switch_user(install_user, install_password)
@@ -149,12 +244,15 @@ def remove_pi_user():
     user_info = config['user']
     admin_user = get_admin_user(user_info)
 
-    switch_user(admin_user.name, admin_user.password)
+    switch_user(admin_user.name, admin_user.password, login=True)
 
     cmd = 'deluser -r pi'
     sudo(cmd)
 
 @task
+@requires('create_users', 'create_all_aliases', 'install_python_libs')
+@incremental(config, sections=['user', 'pyenv', 'python'],
+             git_urls=['pyenv.git_url', 'pyenv.update_git_url'])
 def install_pyenv():
     user_info       = config['user']
     pyenv           = config['pyenv']
@@ -162,87 +260,75 @@ def install_pyenv():
     users           = user_info['accounts']
     git_url         = pyenv['git_url']
     git_update_url  = pyenv['update_git_url']
-    
+    pyenv_path      = pyenv['root']
+    shortcuts       = pyenv['shortcuts']
+    build_deps      = config['python_system_libs']
+
     pi_user = User(install_user, False, True)
     pi_user.password = install_password
-    users.append(pi_user)
-
-    for user in users:
-        switch_user(user.name, user.password)
+    users = users + [pi_user]
 
-        home_path   = get_user_home_dir(user.name)
-        pyenv_path  = os.path.join(home_path, '.pyenv')
-        update_path = os.path.join(pyenv_path, 'plugins', 'pyenv-update')
+    # One system wide pyenv root is shared by every user on the host
+    switch_user(install_user, install_password)
 
-        cmd = 'mkdir -p %s' % (pyenv_path)
-        run(cmd)
+    sync_repo(git_url, pyenv_path, use_sudo=True)
 
-        cmd = 'git clone %s %s' % (git_url, pyenv_path)
-        run(cmd)
+    update_path = os.path.join(pyenv_path, 'plugins', 'pyenv-update')
+    sync_repo(git_update_url, update_path, use_sudo=True)
 
-        update_path = os.path.join(pyenv_path, 'plugins', 'pyenv-update')
-        cmd = 'git clone %s %s' % (git_update_url, update_path)
-        run(cmd)
+    for user in users:
+        switch_user(user.name, user.password)
+        setup_pyenv(user, shortcuts)
 
-        setup_pyenv(user)
-        setup_python(user, python)
+    switch_user(install_user, install_password)
+    setup_python(python, pyenv_path, shortcuts, build_deps)
 
-def setup_pyenv(user):
+def setup_pyenv(user, shortcuts):
     home_path = get_user_home_dir(user.name)
     bashrc = os.path.join(home_path, '.bashrc')
 
-    cmd = """echo '' >> {}""".format(bashrc)
-    run(cmd)
-
-    cmd = """echo '# Pyenv setup' >> {}""".format(bashrc)
-    run(cmd)
+    with CommandBatch() as batch:
+        cmd = get_append_cmd('# Pyenv setup', bashrc)
+        batch.add(cmd)
 
-    cmd = """echo 'export PYENV_ROOT="$HOME/.pyenv"' >> {}""".format(bashrc)
-    run(cmd)
+        for shortcut in shortcuts:
+            cmd = get_append_cmd(shortcut, bashrc)
+            batch.add(cmd)
 
-    cmd = """echo 'export PATH="$PYENV_ROOT/bin:$PATH"' >> {}""".format(bashrc)
-    run(cmd)
-
-    cmd = """echo 'eval "$(pyenv init -)"' >> {}""".format(bashrc)
-    run(cmd)
-
-def setup_python(user, python):
-    home_path       = get_user_home_dir(user.name)
-    pyenv_path      = os.path.join(home_path, '.pyenv')
+def setup_python(python, pyenv_path, shortcuts, build_deps):
     versions        = python['versions']
     current_version = python['current_version']
 
     if current_version not in versions:
         raise DeployException('Current version of python not in python list')
 
-    cmd1 = 'PYENV_ROOT="{}"'.format(pyenv_path)
-    cmd2 = 'PATH="$PYENV_ROOT/bin:$PATH"'
-    cmd3 = 'eval "$(pyenv init -)"'
-    cmd_str = '{}; {}; {}'.format(cmd1, cmd2, cmd3)
-
-    with prefix(cmd_str):
+    with prefix('; '.join(shortcuts)):
         for version in versions:
-            cmd = 'pyenv install %s' % (version)
-            run(cmd)
+            install_interpreter(version, pyenv_path, build_deps)
 
-        cmd = 'pyenv global %s' % (current_version)
-        run(cmd)
+        cmd = 'pyenv rehash && pyenv global %s' % (current_version)
+        sudo(cmd)
 
 @task
+@requires('create_users', 'install_pyenv')
+@incremental(config, sections=['user', 'home_assistant', 'python', 'images', 'releases', 'config_sync'],
+             git_urls=['home_assistant.git_src_url', 'home_assistant.git_config_url'],
+             local_trees=['config_sync'])
 def install_home_assistant():
     user_info       = config['user']
     home_assistant  = config['home_assistant']
-    git_src_url     = home_assistant['git_src_url']
     root_path       = home_assistant['root_dir']
-    source_dir      = home_assistant['source_dir']
-    venv_dir        = home_assistant['venv_dir']
     use_git_config  = home_assistant['use_git_config']
     config_dir      = home_assistant['config_dir']
     git_config_url  = home_assistant['git_config_url']
+    config_sync     = config['config_sync']
     ha_user         = get_ha_user(user_info)
 
     switch_user(install_user, install_password)
 
+    if config_sync['enable']:
+        run_routine(install_delta_helper(fabric_session))
+
     ha_path = os.path.join('/srv', root_path)
     cmd = 'mkdir -p %s' % (ha_path)
     sudo(cmd)
@@ -252,25 +338,62 @@ def install_home_assistant():
 
     switch_user(ha_user.name, ha_user.password)
 
-    src_path = os.path.join(ha_path, source_dir)
-    cmd = 'mkdir -p %s' % (src_path)
+    # The config checkout is shared by every release
+    config_path = os.path.join(ha_path, config_dir)
+    cmd = 'mkdir -p %s' % (config_path)
     run(cmd)
 
-    cmd = 'git clone %s %s' % (git_src_url, src_path)
-    run(cmd)
+    if config_sync['enable']:
+        sync_config(config_sync['local_dir'], config_path, config_sync)
+    elif use_git_config and git_config_url:
+        sync_repo(git_config_url, config_path)
 
-    config_path = os.path.join(ha_path, config_dir)
-    cmd = 'mkdir -p %s' % (config_path)
+    release_path = build_release(ha_path)
+
+    switch_user(install_user, install_password)
+    activate_release(ha_path, release_path, config['releases'])
+
+def build_release(ha_path):
+    home_assistant  = config['home_assistant']
+    git_src_url     = home_assistant['git_src_url']
+    source_dir      = home_assistant['source_dir']
+    venv_dir        = home_assistant['venv_dir']
+    release         = get_release_name(config)
+    release_path    = get_release_path(ha_path, release)
+    image           = get_image_name('home_assistant', release)
+
+    cmd = 'mkdir -p %s' % (release_path)
     run(cmd)
 
-    if use_git_config and git_config_url:
-        cmd = 'git clone %s %s' % (git_config_url, config_path)
+    # A copy of the active release lets the image go out as a delta,
+    # only an image rewrites every file that has the old path baked in
+    if env.image_settings['enable'] and has_image(image):
+        seed_release(ha_path, release_path, [source_dir, venv_dir, IMAGE_MARKER])
+
+    def build_tree():
+        src_path = os.path.join(release_path, source_dir)
+
+        if env.git_mirror['enable']:
+            seed_release(ha_path, release_path, [source_dir])
+
+        cmd = 'mkdir -p %s' % (src_path)
         run(cmd)
 
-    install_home_assistant_deps()
+        sync_repo(git_src_url, src_path)
+        install_home_assistant_deps(release_path)
+
+    # The first host assembles the release, the rest unpack its image
+    provision_from_image(image, release_path, [source_dir, venv_dir], build_tree)
+
+    return release_path
 
 @task
-def install_home_assistant_deps():
+@requires('install_home_assistant', 'install_pyenv')
+@incremental(config, sections=['home_assistant', 'python'],
+             git_urls=['home_assistant.git_src_url'])
+def install_home_assistant_deps(release_path=None):
+    # build_release calls this for the new release, run on its own it
+    # reinstalls into the active release
     user_info       = config['user']
     home_assistant  = config['home_assistant']
     venv_dir        = home_assistant['venv_dir']
@@ -279,73 +402,109 @@ def install_home_assistant_deps():
     pyenv           = config['pyenv']
     python          = config['python']
     ha_user         = get_ha_user(user_info)
-    home_path       = get_user_home_dir(ha_user.name)
-    pyenv_path      = os.path.join(home_path, '.pyenv')
     ha_path         = os.path.join('/srv', root_path)
-    src_path        = os.path.join(ha_path, source_dir)
+    wheel_path      = os.path.join(ha_path, home_assistant['wheelhouse_dir'])
+    wheel_key       = '{}-{}'.format(python['current_version'], get_facts()['arch'])
 
     switch_user(ha_user.name, ha_user.password)
 
-    cmd1 = 'PYENV_ROOT="{}"'.format(pyenv_path)
-    cmd2 = 'PATH="$PYENV_ROOT/bin:$PATH"'
-    cmd3 = 'eval "$(pyenv init -)"'
-    cmd_str = '{}; {}; {}'.format(cmd1, cmd2, cmd3)
+    release_path = release_path or get_active_release(ha_path)
+
+    if not release_path:
+        raise DeployException('No active release in %s' % (ha_path))
+
+    src_path = os.path.join(release_path, source_dir)
+    cmd_str = '; '.join(pyenv['shortcuts'])
 
     with prefix(cmd_str):
+        # The shared pyenv root is owned by root
         cmd = 'pip install virtualenv'
-        run(cmd)
+        sudo(cmd)
 
-        cmd = 'cd {}'.format(ha_path)
+        cmd = 'cd {}'.format(release_path)
 
         with prefix(cmd):
             cmd = 'virtualenv %s' % (venv_dir)
             run(cmd)
 
-            venv_path = os.path.join(ha_path, venv_dir)
+            venv_path = os.path.join(release_path, venv_dir)
             venv_activate = os.path.join(venv_path, 'bin', 'activate')
             cmd = '. {}'.format(venv_activate)
 
             with prefix(cmd):
-                cmd = 'pip install -e %s' % (src_path)
-                run(cmd)
+                requirements = '-e %s' % (src_path)
+                pip_install(requirements, wheel_key, wheel_path)
 
 @task
-def install_service():
-    service_file = config['service_file']
+def push_config():
+    home_assistant  = config['home_assistant']
+    config_sync     = config['config_sync']
+    releases        = config['releases']
+    ha_user         = get_ha_user(config['user'])
+    config_path     = os.path.join('/srv', home_assistant['root_dir'], home_assistant['config_dir'])
 
     switch_user(install_user, install_password)
-    put(service_file, '/etc/systemd/system/home-assistant.service', use_sudo=True)
+    run_routine(install_delta_helper(fabric_session))
 
-    cmd = 'systemctl enable home-assistant'
-    sudo(cmd)
+    switch_user(ha_user.name, ha_user.password)
+    changed = sync_config(config_sync['local_dir'], config_path, config_sync)
 
-    cmd = 'systemctl start home-assistant'
+    if not changed:
+        return
+
+    # Edits HA can reload in place skip the restart and keep it serving
+    switch_user(install_user, install_password)
+    restart = reload_config(changed, config_sync, releases['port'], lazy_secret('home_assistant.api_token'))
+
+    if not restart or not is_active(releases['service']):
+        return
+
+    started_at = time.time()
+    cmd = 'systemctl restart {}'.format(releases['service'])
     sudo(cmd)
 
+    probes = get_probes(config, ['home-assistant'])
+
+    if wait_for_services([env.host_string], probes, config['readiness'], started_at):
+        raise DeployException('home-assistant did not become ready on %s' % (env.host_string))
+
 @task
+@requires('install_home_assistant')
+@incremental(config, sections=['managed_files', 'home_assistant', 'user'],
+             files=['home-assistant.service'])
+def install_service():
+    switch_user(install_user, install_password)
+    run_routine(install_ha_service(fabric_session, config))
+
+@task
+@requires('install_packages')
+@incremental(config, sections=['firewall'])
 def install_firewall():
     firewall = config['firewall']
 
     if firewall['enable']:
         switch_user(install_user, install_password)
-        packages = ['ufw', 'GUFW']
-        install_native(packages)
+        install_native(firewall['system_libs'])
 
-        cmd = 'ufw default deny incoming'
-        sudo(cmd)
+        with CommandBatch(use_sudo=True) as batch:
+            cmd = 'ufw default deny incoming'
+            batch.add(cmd)
 
-        cmd = 'ufw default allow outgoing'
-        sudo(cmd)
+            cmd = 'ufw default allow outgoing'
+            batch.add(cmd)
 
-        for app in firewall['allowed']:
-            cmd = 'ufw allow %s' % (app)
-            sudo(cmd)
+            for app in firewall['allowed']:
+                cmd = 'ufw allow %s' % (app)
+                batch.add(cmd)
 
-        cmd = """echo "y" | sudo ufw enable"""
-        run(cmd)
+            cmd = """echo "y" | ufw enable"""
+            batch.add(cmd)
 
 @task
-def install_openzwave():
+@requires('install_packages', 'install_home_assistant', 'install_service')
+@incremental(config, sections=['openzwave', 'home_assistant', 'python'],
+             git_urls=['openzwave.git_url'])
+def install_openzwave(release_path=None):
     user_info               = config['user']
     openzwave               = config['openzwave']
     openzwave_system_libs   = openzwave['system_libs']
@@ -357,8 +516,10 @@ def install_openzwave():
     root_path               = home_assistant['root_dir']
     ha_user                 = get_ha_user(user_info)
     ha_path                 = os.path.join('/srv', root_path)
-    home_path               = get_user_home_dir(ha_user.name)
-    pyenv_path              = os.path.join(home_path, '.pyenv')
+    pyenv                   = config['pyenv']
+    python                  = config['python']
+    wheel_path              = os.path.join(ha_path, home_assistant['wheelhouse_dir'])
+    wheel_key               = '{}-{}'.format(python['current_version'], get_facts()['arch'])
 
     switch_user(install_user, install_password)
     install_native(openzwave_system_libs)
@@ -370,48 +531,64 @@ def install_openzwave():
     cmd = 'chown -R {}:{} {}'.format(ha_user.name, ha_user.name, openzwave_path)
     sudo(cmd)
 
-    sudo('service home-assistant stop')
     switch_user(ha_user.name, ha_user.password)
 
-    cmd1 = 'PYENV_ROOT="{}"'.format(pyenv_path)
-    cmd2 = 'PATH="$PYENV_ROOT/bin:$PATH"'
-    cmd3 = 'eval "$(pyenv init -)"'
-    cmd_str = '{}; {}; {}'.format(cmd1, cmd2, cmd3)
+    active_path = get_active_release(ha_path)
+    release_path = release_path or active_path
+
+    if not release_path:
+        raise DeployException('No active release in %s' % (ha_path))
+
+    cmd_str = '; '.join(pyenv['shortcuts'])
 
     with prefix(cmd_str):
-        cmd = 'cd {}'.format(ha_path)
+        cmd = 'cd {}'.format(release_path)
         run(cmd)
 
-        venv_path = os.path.join(ha_path, venv_dir)
+        venv_path = os.path.join(release_path, venv_dir)
         venv_activate = os.path.join(venv_path, 'bin', 'activate')
         cmd = '. {}'.format(venv_activate)
 
         with prefix(cmd):
             libs = ' '.join(openzwave_python_libs)
-            cmd = 'pip install {}'.format(libs)
-            run(cmd)
+            pip_install(libs, wheel_key, wheel_path)
             py_openzwave_path = os.path.join(openzwave_path, 'python_openzwave')
 
-            cmd = 'rm -rf {}'.format(py_openzwave_path)
-            run(cmd)
+            if not unpack_component('python-openzwave', openzwave_path):
+                # A mirrored checkout is updated in place so make only
+                # rebuilds what changed
+                if not env.git_mirror['enable']:
+                    cmd = 'rm -rf {}'.format(py_openzwave_path)
+                    run(cmd)
 
-            cmd = 'git clone {} {}'.format(openzwave_git_url, py_openzwave_path)
-            run(cmd)
+                sync_repo(openzwave_git_url, py_openzwave_path, branch='python3')
 
-            with cd(py_openzwave_path):
-                cmd = 'git checkout --track origin/python3'
-                run(cmd)
+                with cd(py_openzwave_path):
+                    cmd = 'make build'
+                    timed_build('python-openzwave', cmd)
+
+                pack_component('python-openzwave', openzwave_path, ['python_openzwave'])
 
-                cmd = 'make build'
-                run(cmd)
+            # Only the install touches the venv, and a release that is
+            # not serving yet does not need the service stopped at all
+            live = release_path == active_path
 
+            if live:
+                switch_user(install_user, install_password)
+                sudo('service home-assistant stop')
+                switch_user(ha_user.name, ha_user.password)
+
+            with cd(py_openzwave_path):
                 cmd = 'make install'
-                run(cmd)
+                run(cmd, tail=True)
 
-    switch_user(install_user, install_password)
-    sudo('service home-assistant start')
+    if live:
+        switch_user(install_user, install_password)
+        sudo('service home-assistant start')
 
 @task
+@requires('create_users', 'install_packages')
+@incremental(config, sections=['libmicrohttpd'])
 def install_micro_httpd():
     user_info               = config['user']
     home_assistant          = config['home_assistant']
@@ -435,30 +612,40 @@ def install_micro_httpd():
 
     switch_user(admin_user.name, admin_user.password)
 
+    lib_dir = '.'.join(lib.split('.')[:-2])
+
     with cd(install_path):
-        ftp_path = os.path.join(ftp_site, lib)
-        cmd = 'wget {}'.format(ftp_path)
-        run(cmd)
+        if not unpack_component('libmicrohttpd', install_path):
+            ftp_path = os.path.join(ftp_site, lib)
+            install_artifact(ftp_path, lib)
 
-        cmd = 'tar zxvf {}'.format(lib)
-        run(cmd)
+            cmd = 'tar zxvf {}'.format(lib)
+            run(cmd, tail=True)
+
+            with cd(lib_dir):
+                timed_build('libmicrohttpd-configure', './configure')
+                timed_build('libmicrohttpd', 'make')
 
-        lib_dir = '.'.join(lib.split('.')[:-2])
+            pack_component('libmicrohttpd', install_path, [lib_dir])
 
         with cd(lib_dir):
-            run('./configure')
-            run('make')
-            sudo('make install')
+            sudo('make install', tail=True)
 
 @task
+@requires('install_openzwave', 'install_micro_httpd')
+@incremental(config, sections=['openzwave_ctrl', 'managed_files'],
+             files=['./files/openzwave_ctrl_makefile'],
+             git_urls=['openzwave_ctrl.git_url'])
 def install_openzwave_ctrl():
     user_info               = config['user']
     ha_user                 = get_ha_user(user_info)
-    ha_path                 = os.path.join('/srv', root_path)
+    home_assistant          = config['home_assistant']
+    ha_path                 = os.path.join('/srv', home_assistant['root_dir'])
     openzwave_ctrl          = config['openzwave_ctrl']
     openzwave_dir           = openzwave_ctrl['dir']
     install_dir             = openzwave_ctrl['install_dir']
     git_url                 = openzwave_ctrl['git_url']
+    venv_path               = os.path.join(ha_path, 'current', home_assistant['venv_dir'])
 
     switch_user(install_user, install_password)
 
@@ -469,17 +656,28 @@ def install_openzwave_ctrl():
     switch_user(ha_user.name, ha_user.password)
 
     install_path = os.path.join(openzwave_path, install_dir)
-    cmd = 'git clone {} {}'.format(git_url, install_path)
-    run(cmd)
 
-    with cd(install_path):
-        put('./files/openzwave_ctrl_makefile', 'Makefile')
-        run("make")
+    if not unpack_component('openzwave-ctrl', openzwave_path):
+        sync_repo(git_url, install_path)
+
+        sync_managed_files('openzwave_ctrl_makefile')
+
+        with cd(install_path):
+            timed_build('openzwave-ctrl', 'make')
 
+        pack_component('openzwave-ctrl', openzwave_path, [install_dir])
+
+    with cd(install_path):
         switch_user(install_user, install_password)
-        sudo("ln -sd /srv/home_assistant/ha_env/lib/python3.6/site-packages/libopenzwave-0.3.1-py3.6-linux-armv7l.egg/config")
+
+        # The egg directory name carries the openzwave version and platform
+        egg_config = os.path.join(venv_path, 'lib', 'python*', 'site-packages', 'libopenzwave-*.egg', 'config')
+        sudo('ln -sfn $(ls -d {} | head -1) config'.format(egg_config))
 
 @task
+@requires('create_users', 'install_packages')
+@incremental(config, sections=['mqtt', 'user', 'managed_files'],
+             files=['./files/mosquitto.conf'])
 def install_mqtt():
     user_info               = config['user']
     admin_user              = get_admin_user(user_info)
@@ -487,39 +685,46 @@ def install_mqtt():
     mqtt                    = config['mqtt']
     app_dir                 = mqtt['dir']
     system_libs             = mqtt['system_libs']
-    users                   = mqtt['users']
 
+    add_mqtt_repo()
     switch_user(admin_user.name, admin_user.password)
 
     app_path = os.path.join('/opt', app_dir)
-    cmd = 'mkdir -p {}'.format(app_path)
+    install_native(system_libs)
+
+    cmd = 'chown -R {}:{} {}'.format(mos_srv_user.name, mos_srv_user.name, app_path)
     sudo(cmd)
 
-    with cd(app_path):
-        run("wget http://repo.mosquitto.org/debian/mosquitto-repo.gpg.key")
-        sudo("apt-key add mosquitto-repo.gpg.key")
+    run_routine(configure_mqtt(fabric_session, config))
 
-        with cd("/etc/apt/sources.list.d/"):
-            sudo("wget http://repo.mosquitto.org/debian/mosquitto-jessie.list")
-            install_native(system_libs)
+@task
+def show_facts(refresh=False):
+    facts = get_facts(refresh=bool(refresh))
 
-            with cd("/etc/mosquitto"):
-                put("./files/mosquitto.conf", "mosquitto.conf", use_sudo=True)
-                sudo('chown root:root mosquitto.conf')
-                sudo("touch pwfile")
+    print('arch:      %s' % (facts['arch']))
+    print('nproc:     %s' % (facts['nproc']))
+    print('memory:    %s/%s MB available' % (facts['mem_available_mb'], facts['mem_total_mb']))
+    print('packages:  %d installed' % (len(facts['packages'])))
 
-                cmd = 'chown {}:{} pwfile'.format(mos_srv_user.name, mos_srv_user.name)
-                sudo(cmd)
-                sudo("chmod 0600 pwfile")
+    for root, versions in sorted(facts['pyenv'].items()):
+        print('pyenv:     %s %s' % (root, ' '.join(versions)))
 
-                switch_user(mos_srv_user.name, mos_srv_user.password)
+    for service, state in sorted(facts['services'].items()):
+        print('service:   %s %s' % (service, state))
 
-                for user in users:
-                    cmd = 'sudo mosquitto_passwd -b pwfile {} {}'.format(user.name, user.password)
-                    sudo(cmd)
+@task
+def set_secret(name):
+    # Names are user.<account>, mqtt.<user> or home_assistant.api_token
+    store_secret(name, prompt_secret(name))
 
-    cmd = 'chown -R {}:{} {}'.format(mos_srv_user.name, mos_srv_user.name, app_path)
-    sudo(cmd)
+@task
+def show_secrets():
+    names = ['user.%s' % (user.name) for user in config['user']['accounts']]
+    names += ['mqtt.%s' % (user.name) for user in config['mqtt']['users']]
+    names += ['home_assistant.api_token']
+
+    for name in names:
+        print('%-24s %s' % (name, get_secret_source(name)))
 
 @task
 def test():
@@ -542,7 +747,7 @@ def test():
 # Main
 # --------------------------------------------------------------------------
 @task
-def install_all():
+def install_all(concurrency=4):
     # Manual steps(sudo raspi-config):
     #   1.  Expand filesystem
     #   2.  Change hostname
@@ -553,28 +758,198 @@ def install_all():
     #   7.  Change wifi country
     #   8.  Setup wifi password
 
-    create_users()
-    create_all_aliases()
-    install_system_apps()
-    install_python_libs()
-    cleanup_opt()
-    install_pyenv()
-    install_home_assistant()
-    install_home_assistant_deps()
-    install_service()
-    install_firewall()
-    install_openzwave()
-    install_micro_httpd()
-    install_openzwave_ctrl()
-    install_mqtt()
+    stages = [  create_users,
+                add_mqtt_repo,
+                install_packages,
+                create_all_aliases,
+                install_system_apps,
+                install_python_libs,
+                cleanup_opt,
+                install_pyenv,
+                install_home_assistant,
+                install_service,
+                install_firewall,
+                install_openzwave,
+                install_micro_httpd,
+                install_openzwave_ctrl,
+                install_mqtt    ]
+
+    # Gather facts once so every forked stage starts with them cached
+    get_facts()
+    load_secrets()
+
+    stages = dict([(stage.name, stage) for stage in stages])
+    results = run_stages(stages, int(concurrency))
+    failed = print_stage_summary(results, get_stage_order(stages))
+    print_pool_stats('install_all')
+
+    if failed:
+        raise DeployException('Install failed at: %s' % (', '.join(failed)))
+
+@task
+@runs_once
+def fleet(task_name='install_all', group=None, concurrency=None):
+    inventory   = config['inventory']
+    overrides   = inventory.get('overrides', {})
+    hosts       = get_fleet_hosts(inventory, group)
+    concurrency = int(concurrency or inventory['concurrency'])
+    fleet_task  = globals().get(task_name)
+
+    if task_name == 'fleet' or not hasattr(fleet_task, 'run'):
+        raise DeployException('Unknown task for fleet run: %s' % (task_name))
+
+    load_secrets()
+    results = run_on_fleet(fleet_task, hosts, concurrency, config, overrides)
+    failed = print_summary(results)
+
+    if task_name == 'install_all':
+        ready_hosts = [host for host in hosts if host not in failed]
+        failed.extend(wait_for_services(ready_hosts, get_probes(config), config['readiness']))
+
+    if failed:
+        raise DeployException('Fleet run failed on: %s' % (', '.join(sorted(failed))))
+
+@task
+@runs_once
+def engine(task_name='show_facts', group=None, concurrency=None, backend=None):
+    # Tasks ported to the async engine drive every host from one process,
+    # each host gets its own session so nothing goes through env
+    inventory   = config['inventory']
+    overrides   = inventory.get('overrides', {})
+    hosts       = get_fleet_hosts(inventory, group)
+    concurrency = int(concurrency or config['engine']['concurrency'])
+    host_task   = host_tasks.get(task_name)
+
+    # Only host configuration is ported, see async_tasks
+    if host_task is None:
+        raise DeployException('Task not available on the engine: %s, choose from %s' % (task_name, ', '.join(sorted(host_tasks))))
+
+    if backend:
+        config['engine']['backend'] = backend
+
+    load_secrets()
+    results = run_engine(host_task, hosts, concurrency, config, overrides, install_user, install_password)
+    failed = print_summary(results)
+
+    if failed:
+        raise DeployException('Engine run failed on: %s' % (', '.join(sorted(failed))))
+
+@task
+@runs_once
+def plan(task_name='install_all', group=None):
+    # Run a task against a recorder instead of the hosts and compare the
+    # commands with the last plan
+    inventory   = config['inventory']
+    overrides   = inventory.get('overrides', {})
+    hosts       = get_fleet_hosts(inventory, group) if group else [env.host_string]
+    planned     = globals().get(task_name)
+
+    if task_name in ['plan', 'fleet'] or not hasattr(planned, 'run'):
+        raise DeployException('Unknown task to plan: %s' % (task_name))
+
+    concurrency = int(inventory['concurrency']) if len(hosts) > 1 else 1
+    results = run_on_fleet(plan_task(planned), hosts, concurrency, config, overrides)
+    facts_cache.clear()
+    failed = print_summary(results)
+
+    if failed:
+        raise DeployException('Planning failed on: %s' % (', '.join(sorted(failed))))
+
+@task
+@runs_once
+def check_ready(group=None):
+    # Probe every service on every host at once
+    hosts = get_fleet_hosts(config['inventory'], group)
+    failed = wait_for_services(hosts, get_probes(config), config['readiness'])
+
+    if failed:
+        raise DeployException('Not ready: %s' % (', '.join(failed)))
+
+@task
+@runs_once
+def distribute_builds(group=None, concurrency=None):
+    # Compile once per architecture and relay the result to the rest of
+    # the fleet, a following fleet run installs the prebuilt components
+    inventory   = config['inventory']
+    overrides   = inventory.get('overrides', {})
+    hosts       = get_fleet_hosts(inventory, group)
+    concurrency = int(concurrency or inventory['concurrency'])
+    tasks       = [install_micro_httpd, install_openzwave, install_openzwave_ctrl]
+
+    load_secrets()
+    results = build_and_distribute(tasks, hosts, concurrency, config, overrides)
+    failed = print_summary(results)
+
+    if failed:
+        raise DeployException('Distribution failed on: %s' % (', '.join(sorted(failed))))
+
+def deploy_release():
+    user_info       = config['user']
+    home_assistant  = config['home_assistant']
+    ha_user         = get_ha_user(user_info)
+    ha_path         = os.path.join('/srv', home_assistant['root_dir'])
+    settings        = config['releases']
+
+    # The active release keeps serving while the new one is built
+    switch_user(ha_user.name, ha_user.password)
+    release_path = build_release(ha_path)
+    install_openzwave(release_path)
+
+    switch_user(install_user, install_password)
+    activate_release(ha_path, release_path, settings)
+
+    switch_user(ha_user.name, ha_user.password)
+    prune_releases(ha_path, settings['keep'])
+
+def deploy_release_or_rollback():
+    home_assistant  = config['home_assistant']
+    ha_path         = os.path.join('/srv', home_assistant['root_dir'])
+    previous        = get_active_release(ha_path)
+
+    try:
+        deploy_release()
+    except BaseException:
+        # A failure before the switch leaves the previous release active
+        # and activating it again does nothing
+        if previous:
+            print('[%s] rolling back to %s' % (env.host_string, os.path.basename(previous)))
+            switch_user(install_user, install_password)
+            activate_release(ha_path, previous, config['releases'])
+
+        raise
 
 @task
 def deploy_dev():
-    pass
+    deploy_release()
 
 @task
-def deploy_prod():
-    pass
+@runs_once
+def deploy_prod(group=None):
+    # One host at a time so the rest of the fleet keeps serving
+    inventory   = config['inventory']
+    overrides   = inventory.get('overrides', {})
+    hosts       = get_fleet_hosts(inventory, group)
+
+    load_secrets()
+    results = run_rolling(deploy_release_or_rollback, hosts, config, overrides)
+    print_summary(results)
+
+    failed = [h for h in hosts if results[h]['status'] == 'failed']
+    skipped = [h for h in hosts if results[h]['status'] == 'skipped']
+
+    if skipped:
+        print('Rollout stopped, not attempted: %s' % (', '.join(skipped)))
+
+    if failed:
+        raise DeployException('Deploy failed on: %s' % (', '.join(failed)))
+
+@task
+def rollback():
+    home_assistant  = config['home_assistant']
+    ha_path         = os.path.join('/srv', home_assistant['root_dir'])
+
+    switch_user(install_user, install_password)
+    rollback_release(ha_path, config['releases'])
 
 
 # Testing OPENZWAVE-CTRL
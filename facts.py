@@ -0,0 +1,264 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import json
+import time
+import fcntl
+
+from fabric.api import env
+
+from batch import run_script
+from plan import is_planning
+
+
+SECTION_MARKER  = '__facts__'
+MARKER_DIR      = '/var/lib/ha_deploy/markers'
+ARTIFACT_DIR    = '/var/cache/ha_deploy/artifacts'
+
+facts_cache = {}
+
+
+# Gather functions
+# --------------------------------------------------------------------------
+def render_facts_script(services, pyenv_roots):
+    lines = []
+
+    lines.append('echo %s passwd' % (SECTION_MARKER))
+    lines.append('getent passwd')
+
+    lines.append('echo %s arch' % (SECTION_MARKER))
+    lines.append('uname -m')
+
+    lines.append('echo %s libc' % (SECTION_MARKER))
+    lines.append("ldd --version 2>&1 | head -1 | awk '{print $NF}'")
+
+    lines.append('echo %s nproc' % (SECTION_MARKER))
+    lines.append('nproc')
+
+    lines.append('echo %s meminfo' % (SECTION_MARKER))
+    lines.append("grep -E '^(MemTotal|MemAvailable):' /proc/meminfo")
+
+    lines.append('echo %s packages' % (SECTION_MARKER))
+    lines.append("dpkg-query -W -f='${Package} ${Status}\\n' 2>/dev/null")
+
+    lines.append('echo %s apt' % (SECTION_MARKER))
+    lines.append('date +%s')
+    lines.append("find /var/lib/apt/lists -maxdepth 1 -type f -name '*Packages*' -printf '%T@\\n' 2>/dev/null | sort -n | tail -1")
+
+    lines.append('echo %s apt_sources' % (SECTION_MARKER))
+    lines.append('ls /etc/apt/sources.list.d 2>/dev/null')
+
+    lines.append('echo %s pyenv' % (SECTION_MARKER))
+    roots = ' '.join(pyenv_roots)
+    lines.append('for root in $(getent passwd | cut -d: -f6 | sed "s|$|/.pyenv|") %s; do' % (roots))
+    lines.append('    [ -d "$root/versions" ] && echo "$root" $(ls "$root/versions")')
+    lines.append('done')
+
+    lines.append('echo %s markers' % (SECTION_MARKER))
+    lines.append('for marker in %s/*; do' % (MARKER_DIR))
+    lines.append('    [ -f "$marker" ] && echo "$(basename $marker) $(cat $marker)"')
+    lines.append('done')
+
+    lines.append('echo %s artifacts' % (SECTION_MARKER))
+    lines.append('ls %s 2>/dev/null' % (ARTIFACT_DIR))
+
+    lines.append('echo %s services' % (SECTION_MARKER))
+    lines.append('for service in %s; do' % (' '.join(services)))
+    lines.append('    echo "$service $(systemctl is-active $service 2>/dev/null)"')
+    lines.append('done')
+
+    lines.append('exit 0')
+
+    return '\n'.join(lines) + '\n'
+
+def parse_facts(result):
+    sections = {}
+    section = None
+
+    for line in result.splitlines():
+        tokens = line.strip().split()
+
+        if len(tokens) == 2 and tokens[0] == SECTION_MARKER:
+            section = tokens[1]
+            sections[section] = []
+        elif section and tokens:
+            sections[section].append(line.strip())
+
+    facts = {   'users':            {},
+                'packages':         [],
+                'pyenv':            {},
+                'markers':          {},
+                'services':         {},
+                'apt_updated_at':   None    }
+
+    for line in sections.get('passwd', []):
+        tokens = line.split(':')
+
+        if len(tokens) > 6:
+            facts['users'][tokens[0]] = {   'uid':      int(tokens[2]),
+                                            'gid':      int(tokens[3]),
+                                            'home':     tokens[5],
+                                            'shell':    tokens[6]   }
+
+    facts['arch'] = (sections.get('arch') or ['unknown'])[0]
+    facts['libc'] = (sections.get('libc') or ['unknown'])[0]
+    facts['nproc'] = int((sections.get('nproc') or ['1'])[0])
+
+    for line in sections.get('meminfo', []):
+        name, value = line.split()[:2]
+        key = 'mem_total_mb' if name.startswith('MemTotal') else 'mem_available_mb'
+        facts[key] = int(value) // 1024
+
+    for line in sections.get('packages', []):
+        tokens = line.split()
+
+        if tokens[-1] == 'installed':
+            facts['packages'].append(tokens[0])
+
+    apt = sections.get('apt', [])
+
+    # Compare against the remote clock so skew with the control host
+    # does not matter
+    if len(apt) > 1:
+        age = int(apt[0]) - float(apt[1])
+        facts['apt_updated_at'] = time.time() - age
+
+    facts['apt_sources'] = sections.get('apt_sources', [])
+
+    for line in sections.get('pyenv', []):
+        tokens = line.split()
+        facts['pyenv'][tokens[0]] = tokens[1:]
+
+    for line in sections.get('markers', []):
+        tokens = line.split()
+
+        if len(tokens) == 2:
+            facts['markers'][tokens[0]] = tokens[1]
+
+    facts['artifacts'] = [line for line in sections.get('artifacts', []) if not line.endswith('.partial')]
+
+    for line in sections.get('services', []):
+        tokens = line.split()
+        facts['services'][tokens[0]] = tokens[1] if len(tokens) > 1 else 'unknown'
+
+    return facts
+
+def build_facts(result, host):
+    facts = parse_facts(result)
+    facts['host'] = host
+    facts['gathered_at'] = time.time()
+
+    return facts
+
+def gather_facts():
+    services = env.get('facts_services', [])
+    result = run_script(render_facts_script(services, [env.pyenv_root]))
+
+    return build_facts(result, env.host)
+
+
+# Cache functions
+# --------------------------------------------------------------------------
+def get_facts_path(host, cache_dir=None):
+    return os.path.join(cache_dir or env.cache_dir, 'facts', '%s.json' % (host))
+
+def load_cached_facts(host):
+    path = get_facts_path(host)
+
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as facts_data:
+        return json.load(facts_data)
+
+def save_facts(facts):
+    # A plan changes the facts in memory only
+    if is_planning():
+        return
+
+    write_facts(facts, env.cache_dir)
+
+def merge_facts(facts, current):
+    # Concurrent stages each add what they installed to the same snapshot,
+    # keep what the others already wrote
+    if current is None or current['gathered_at'] != facts['gathered_at']:
+        return facts
+
+    merged = dict(facts)
+    merged['packages'] = sorted(set(current['packages']) | set(facts['packages']))
+    merged['artifacts'] = sorted(set(current.get('artifacts', [])) | set(facts.get('artifacts', [])))
+    merged['markers'] = dict(current['markers'], **facts['markers'])
+    merged['apt_updated_at'] = max(current['apt_updated_at'] or 0, facts['apt_updated_at'] or 0) or None
+    merged['pyenv'] = dict(current['pyenv'])
+
+    for root, versions in facts['pyenv'].items():
+        merged['pyenv'][root] = sorted(set(merged['pyenv'].get(root, [])) | set(versions))
+
+    return merged
+
+def write_facts(facts, cache_dir):
+    path = get_facts_path(facts['host'], cache_dir)
+
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    # Forked stages write the same file, the lock orders them and the
+    # rename means a reader never sees a half written file
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        current = None
+
+        if os.path.exists(path):
+            with open(path) as facts_data:
+                current = json.load(facts_data)
+
+        with open(path + '.partial', 'w') as facts_data:
+            json.dump(merge_facts(facts, current), facts_data, indent=4, sort_keys=True)
+
+        os.rename(path + '.partial', path)
+
+def is_fresh(facts):
+    ttl = env.get('facts_ttl', 0)
+
+    return facts is not None and time.time() - facts['gathered_at'] < ttl
+
+def get_facts(refresh=False):
+    host = env.host
+    facts = facts_cache.get(host)
+
+    if is_planning():
+        # Plans work from the last facts seen, however old
+        facts = facts or load_cached_facts(host) or gather_facts()
+    else:
+        if not refresh and not is_fresh(facts):
+            facts = load_cached_facts(host)
+
+        if refresh or not is_fresh(facts):
+            facts = gather_facts()
+            save_facts(facts)
+
+    facts_cache[host] = facts
+
+    return facts
+
+def invalidate_facts(host=None):
+    if is_planning():
+        return
+
+    host = host or env.host
+    facts_cache.pop(host, None)
+    remove_facts(host, env.cache_dir)
+
+def remove_facts(host, cache_dir):
+    path = get_facts_path(host, cache_dir)
+
+    if os.path.exists(path):
+        os.remove(path)
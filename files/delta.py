@@ -0,0 +1,76 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import sys
+import hashlib
+
+
+MODULUS = 1 << 16
+
+
+# Checksum functions
+# --------------------------------------------------------------------------
+def weak_checksum(block):
+    a = 0
+    b = 0
+    length = len(block)
+
+    for index, byte in enumerate(block):
+        a += byte
+        b += (length - index) * byte
+
+    return (a % MODULUS) + ((b % MODULUS) << 16)
+
+def signature(path, block_size):
+    # Only full blocks are offered, the tail always travels as data
+    with open(path, 'rb') as src:
+        while True:
+            block = src.read(block_size)
+
+            if len(block) < block_size:
+                break
+
+            sys.stdout.write('%d %s\n' % (weak_checksum(block), hashlib.md5(block).hexdigest()))
+
+
+# Patch functions
+# --------------------------------------------------------------------------
+def patch(path, out_path, expected, block_size):
+    ops = sys.stdin.buffer
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as src, open(out_path, 'wb') as out:
+        while True:
+            line = ops.readline()
+
+            if not line:
+                break
+
+            op, value = line.split()
+
+            if op == b'C':
+                src.seek(int(value) * block_size)
+                data = src.read(block_size)
+            else:
+                data = ops.read(int(value))
+
+            digest.update(data)
+            out.write(data)
+
+    if digest.hexdigest() != expected:
+        os.remove(out_path)
+        sys.stderr.write('delta for %s did not reproduce %s\n' % (path, expected))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    if sys.argv[1] == 'signature':
+        signature(sys.argv[2], int(sys.argv[3]))
+    else:
+        patch(sys.argv[2], sys.argv[3], sys.argv[4], int(sys.argv[5]))
@@ -0,0 +1,144 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import json
+import hashlib
+import subprocess
+from functools import wraps
+
+from fabric.api import env
+
+from facts import MARKER_DIR
+from facts import get_facts
+from facts import save_facts
+from session import sudo
+from session import get_failure_count
+from git_mirror import get_mirror_revision
+from ha_config import get_tree_fingerprint
+
+
+git_revisions = {}
+
+
+# Fingerprint functions
+# --------------------------------------------------------------------------
+def serialize(obj):
+    return obj.__dict__
+
+def get_config_value(config, path):
+    value = config
+
+    for key in path.split('.'):
+        value = value[key]
+
+    return value
+
+def get_git_revision(url):
+    if url not in git_revisions:
+        revision = None
+
+        try:
+            if env.git_mirror['enable']:
+                revision = get_mirror_revision(url)
+            else:
+                cmd = ['git', 'ls-remote', url, 'HEAD']
+                output = subprocess.check_output(cmd, stderr=subprocess.DEVNULL, timeout=30)
+                tokens = output.decode('utf-8').split()
+
+                if tokens:
+                    revision = tokens[0]
+        except (OSError, subprocess.SubprocessError):
+            pass
+
+        git_revisions[url] = revision
+
+    return git_revisions[url]
+
+def compute_fingerprint(config, sections, files, git_urls, local_trees=()):
+    digest = hashlib.sha256()
+
+    for section in sections:
+        value = get_config_value(config, section)
+        digest.update(section.encode('utf-8'))
+        digest.update(json.dumps(value, sort_keys=True, default=serialize).encode('utf-8'))
+
+    for path in files:
+        digest.update(path.encode('utf-8'))
+
+        with open(path, 'rb') as file_data:
+            digest.update(file_data.read())
+
+    # Sections like config_sync push a local directory, its content is
+    # an input as much as the settings are
+    for path in local_trees:
+        settings = get_config_value(config, path)
+
+        if settings.get('enable', True):
+            digest.update(path.encode('utf-8'))
+            digest.update(get_tree_fingerprint(settings).encode('utf-8'))
+
+    for path in git_urls:
+        url = get_config_value(config, path)
+
+        if url:
+            digest.update(url.encode('utf-8'))
+            digest.update(str(get_git_revision(url)).encode('utf-8'))
+
+    return digest.hexdigest()
+
+def get_call_fingerprint(fingerprint, args, kwargs):
+    if not args and not kwargs:
+        return fingerprint
+
+    # The same task called for another target, like a new release,
+    # gets its own marker
+    call = json.dumps([args, kwargs], sort_keys=True, default=serialize)
+
+    return hashlib.sha256((fingerprint + call).encode('utf-8')).hexdigest()
+
+
+# Marker functions
+# --------------------------------------------------------------------------
+def write_marker(name, fingerprint):
+    marker_path = os.path.join(MARKER_DIR, name)
+    cmd = 'mkdir -p {} && echo {} > {}'.format(MARKER_DIR, fingerprint, marker_path)
+    result = sudo(cmd)
+
+    if result.succeeded:
+        facts = get_facts()
+        facts['markers'][name] = fingerprint
+        save_facts(facts)
+
+def incremental(config, sections=(), files=(), git_urls=(), local_trees=()):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            name = func.__name__
+            fingerprint = compute_fingerprint(config, sections, files, git_urls, local_trees)
+            marker = get_call_fingerprint(fingerprint, args, kwargs)
+            markers = get_facts()['markers']
+
+            if not env.get('force') and markers.get(name) == marker:
+                print('[%s] %s is unchanged, skipping' % (env.host_string, name))
+                return
+
+            failures = get_failure_count()
+            env.fingerprint = fingerprint
+            result = func(*args, **kwargs)
+
+            # Only remember the inputs when every remote command succeeded
+            if get_failure_count() == failures:
+                write_marker(name, marker)
+
+            return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,166 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import copy
+import time
+
+from fabric.api import env, execute, parallel
+
+from session import configure_sessions
+from data_structures import DeployException
+
+
+# Settings the tasks read from env rather than from the config
+ENV_SETTINGS = {    'cache_dir':            ('cache', 'dir'),
+                    'facts_ttl':            ('facts', 'ttl'),
+                    'facts_services':       ('facts', 'services'),
+                    'pyenv_root':           ('pyenv', 'root'),
+                    'apt_update_max_age':   ('apt', 'update_max_age'),
+                    'build_settings':       ('build',),
+                    'git_mirror':           ('git_mirror',),
+                    'artifact_settings':    ('artifacts',),
+                    'image_settings':       ('images',),
+                    'trace_settings':       ('tracing',),
+                    'capture_settings':     ('capture',)   }
+
+
+# Inventory functions
+# --------------------------------------------------------------------------
+def get_fleet_hosts(inventory, selector=None):
+    hosts   = inventory.get('hosts', [])
+    groups  = inventory.get('groups', {})
+
+    if not selector:
+        return list(hosts)
+
+    # Fabric splits task arguments on commas so multiple names use ';'
+    selected = []
+
+    for name in selector.split(';'):
+        if name in groups:
+            selected.extend(groups[name])
+        elif name in hosts:
+            selected.append(name)
+        else:
+            raise DeployException('Unknown host or group in inventory: %s' % (name))
+
+    fleet_hosts = []
+
+    for host in selected:
+        if host not in fleet_hosts:
+            fleet_hosts.append(host)
+
+    return fleet_hosts
+
+def apply_overrides(section, overrides):
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(section.get(key), dict):
+            apply_overrides(section[key], value)
+        else:
+            section[key] = value
+
+def apply_env_settings(config):
+    for name, path in ENV_SETTINGS.items():
+        value = config
+
+        for key in path:
+            value = value[key]
+
+        env[name] = value
+
+    configure_sessions(config['connection'])
+
+def restore_overrides(section, original, overrides):
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(section.get(key), dict) and isinstance(original.get(key), dict):
+            restore_overrides(section[key], original[key], value)
+        elif key in original:
+            section[key] = original[key]
+        else:
+            section.pop(key, None)
+
+
+# Runner functions
+# --------------------------------------------------------------------------
+def run_on_fleet(func, hosts, concurrency, config, overrides):
+    def host_task(*args, **kwargs):
+        # Tasks read the shared config, so a host's overrides go into it
+        # for the length of its task and come back out from a copy. With
+        # a concurrency of 1 every host runs in this same process. Values
+        # copied into env follow the config both ways
+        host_overrides = overrides.get(env.host, {})
+        original = copy.deepcopy(config)
+        apply_overrides(config, host_overrides)
+        apply_env_settings(config)
+        start = time.time()
+
+        try:
+            func(*args, **kwargs)
+            status = 'ok'
+            error = ''
+        except BaseException as e:
+            status = 'failed'
+            error = str(e) or e.__class__.__name__
+        finally:
+            restore_overrides(config, original, host_overrides)
+            apply_env_settings(config)
+
+        return {'status': status, 'elapsed': time.time() - start, 'error': error}
+
+    host_task.__name__ = getattr(func, 'name', func.__name__)
+
+    if concurrency > 1:
+        host_task = parallel(pool_size=concurrency)(host_task)
+
+    results = execute(host_task, hosts=hosts)
+
+    for host in hosts:
+        if not isinstance(results.get(host), dict):
+            error = str(results.get(host) or 'no result returned')
+            results[host] = {'status': 'failed', 'elapsed': 0.0, 'error': error}
+
+    return results
+
+def run_rolling(func, hosts, config, overrides):
+    # One host at a time, the first failure stops the rollout so the rest
+    # of the fleet keeps serving what it has
+    results = {}
+
+    for index, host in enumerate(hosts):
+        results.update(run_on_fleet(func, [host], 1, config, overrides))
+
+        if results[host]['status'] != 'ok':
+            for skipped in hosts[index + 1:]:
+                results[skipped] = {'status': 'skipped', 'elapsed': 0.0, 'error': 'not attempted'}
+
+            break
+
+    return results
+
+def print_summary(results):
+    width = max([len(host) for host in results] + [len('HOST')])
+    row = '{:<%d}  {:<7}  {:>9}  {}' % (width)
+
+    print('')
+    print(row.format('HOST', 'STATUS', 'TIME (s)', 'ERROR'))
+
+    for host in sorted(results):
+        result = results[host]
+        elapsed = '%.1f' % (result['elapsed'])
+        print(row.format(host, result['status'], elapsed, result['error']))
+
+    failed = [h for h in results if results[h]['status'] != 'ok']
+    skipped = [h for h in results if results[h]['status'] == 'skipped']
+    slowest = max([r['elapsed'] for r in results.values()] + [0.0])
+
+    print('')
+    print('%d hosts, %d failed, %d not attempted, slowest host %.1fs' % (len(results), len(failed) - len(skipped),
+                                                                         len(skipped), slowest))
+
+    return failed
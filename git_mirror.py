@@ -0,0 +1,180 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import re
+import fcntl
+import tempfile
+import subprocess
+
+from fabric.api import env
+
+from session import run, sudo
+from session import stream
+from plan import is_planning
+from plan import record
+
+
+updated_mirrors = []
+
+
+# Mirror functions
+# --------------------------------------------------------------------------
+def git(mirror_path, *args):
+    cmd = ['git', '--git-dir', mirror_path] + list(args)
+
+    return subprocess.check_output(cmd, stderr=subprocess.DEVNULL).decode('utf-8').strip()
+
+def get_mirror_path(url):
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', url.split('://')[-1]).strip('_')
+
+    return os.path.join(env.cache_dir, 'mirrors', '%s.git' % (name))
+
+def update_mirror(url):
+    mirror_path = get_mirror_path(url)
+
+    # Plans never touch the network, they use the mirror as it is
+    if mirror_path in updated_mirrors or is_planning():
+        return mirror_path
+
+    if not os.path.exists(os.path.dirname(mirror_path)):
+        os.makedirs(os.path.dirname(mirror_path))
+
+    # Fleet hosts run in parallel processes, only one of them fetches
+    with open(mirror_path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        if not os.path.exists(mirror_path):
+            cmd = ['git', 'clone', '--mirror', url, mirror_path]
+        else:
+            cmd = ['git', '--git-dir', mirror_path, 'remote', 'update', '--prune']
+
+        print('[local] updating git mirror of %s' % (url))
+
+        try:
+            subprocess.check_call(cmd)
+        except (OSError, subprocess.CalledProcessError):
+            # Work offline from whatever the mirror already has
+            if not os.path.exists(mirror_path):
+                raise
+
+            print('[local] could not update %s, using the existing mirror' % (url))
+
+    updated_mirrors.append(mirror_path)
+
+    return mirror_path
+
+def get_branch(mirror_path, branch=None):
+    if branch:
+        return branch
+
+    return git(mirror_path, 'symbolic-ref', '--short', 'HEAD')
+
+def get_mirror_revision(url, branch=None):
+    mirror_path = update_mirror(url)
+    branch = get_branch(mirror_path, branch)
+
+    return git(mirror_path, 'rev-parse', 'refs/heads/%s' % (branch))
+
+def has_revision(mirror_path, revision):
+    try:
+        git(mirror_path, 'cat-file', '-e', '%s^{commit}' % (revision))
+    except subprocess.CalledProcessError:
+        return False
+
+    return True
+
+def count_commits(mirror_path, revision, branch):
+    return int(git(mirror_path, 'rev-list', '--count', '%s..refs/heads/%s' % (revision, branch)))
+
+
+# Remote functions
+# --------------------------------------------------------------------------
+def get_remote_revision(dest, use_sudo=False):
+    cmd = 'git -C {} rev-parse HEAD'.format(dest)
+
+    if use_sudo:
+        result = sudo(cmd, quiet=True)
+    else:
+        result = run(cmd, quiet=True)
+
+    if result.failed:
+        return None
+
+    return result.strip()
+
+def clone_repo(url, dest, branch=None, use_sudo=False):
+    cmd = 'git clone {} {}'.format(url, dest)
+
+    if branch:
+        cmd = 'git clone -b {} {} {}'.format(branch, url, dest)
+
+    if use_sudo:
+        return sudo(cmd)
+
+    return run(cmd)
+
+def sync_repo(url, dest, branch=None, use_sudo=False):
+    if is_planning():
+        record('sync', '{} -> {}'.format(url, dest), 'root' if use_sudo else None)
+        return
+
+    if not env.git_mirror['enable']:
+        return clone_repo(url, dest, branch, use_sudo)
+
+    mirror_path = update_mirror(url)
+    branch = get_branch(mirror_path, branch)
+    target = git(mirror_path, 'rev-parse', 'refs/heads/%s' % (branch))
+    current = get_remote_revision(dest, use_sudo)
+
+    if current == target:
+        print('[%s] %s is already at %s' % (env.host_string, dest, target[:12]))
+        return
+
+    # The host is ahead of the mirror, it already has every object the
+    # target needs and an empty range would make git refuse the bundle
+    if current and has_revision(mirror_path, current) and not count_commits(mirror_path, current, branch):
+        print('[%s] %s is ahead of the mirror, resetting to %s' % (env.host_string, dest, target[:12]))
+        cmd = 'git -C {} reset -q --hard {}'.format(dest, target)
+
+        if use_sudo:
+            return sudo(cmd)
+
+        return run(cmd)
+
+    # Only ship the objects the host does not have yet. A checkout that
+    # diverged from the mirror gets the whole branch fetched into it, git
+    # clone refuses a directory that is not empty
+    fetch_cmd = 'git -C {0} fetch -q $f {1} && git -C {0} reset -q --hard FETCH_HEAD'.format(dest, branch)
+
+    if current and has_revision(mirror_path, current):
+        refs = ['%s..refs/heads/%s' % (current, branch)]
+        apply_cmd = fetch_cmd
+    elif current:
+        print('[%s] %s has diverged from the mirror, resetting it to %s' % (env.host_string, dest, target[:12]))
+        refs = ['refs/heads/%s' % (branch)]
+        apply_cmd = fetch_cmd
+    else:
+        refs = ['refs/heads/%s' % (branch)]
+        apply_cmd = 'git clone -q -b {1} $f {0} && git -C {0} remote set-url origin {2}'.format(dest, branch, url)
+
+    handle, bundle_path = tempfile.mkstemp(suffix='.bundle')
+    os.close(handle)
+
+    try:
+        git(mirror_path, 'bundle', 'create', bundle_path, *refs)
+        print('[%s] sending %s (%d bytes) to %s' % (env.host_string, branch, os.path.getsize(bundle_path), dest))
+
+        cmd = 'f=$(mktemp) && cat > $f && {}; rc=$?; rm -f $f; exit $rc'.format(apply_cmd)
+
+        with open(bundle_path, 'rb') as bundle:
+            return stream(cmd, source=bundle, use_sudo=use_sudo)
+    finally:
+        if os.path.exists(bundle_path):
+            os.remove(bundle_path)
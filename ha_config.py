@@ -0,0 +1,202 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import json
+import shlex
+import fnmatch
+import tarfile
+import hashlib
+import tempfile
+import urllib.request
+
+from fabric.api import env
+from fabric.network import normalize
+
+from managed_files import upload_delta
+from session import run
+from session import stream
+from session import fabric_session
+from session import run_routine
+from plan import is_planning
+from plan import record
+from data_structures import DeployException
+
+
+RESTART = 'restart'
+
+
+# Manifest functions
+# --------------------------------------------------------------------------
+def is_excluded(path, exclude):
+    parts = path.split('/')
+
+    return any([fnmatch.fnmatch(path, p) or fnmatch.fnmatch(parts[0], p) for p in exclude])
+
+def hash_file(path):
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as file_data:
+        for chunk in iter(lambda: file_data.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def get_local_manifest(local_dir, exclude):
+    manifest = {}
+
+    for root, dirs, files in os.walk(local_dir):
+        dirs[:] = [d for d in dirs if not is_excluded(os.path.relpath(os.path.join(root, d), local_dir), exclude)]
+
+        for name in files:
+            path = os.path.relpath(os.path.join(root, name), local_dir)
+
+            if not is_excluded(path, exclude):
+                manifest[path] = hash_file(os.path.join(root, name))
+
+    return manifest
+
+def get_tree_fingerprint(settings):
+    manifest = get_local_manifest(settings['local_dir'], settings['exclude'])
+
+    return json.dumps(manifest, sort_keys=True)
+
+def get_manifest_cmd(config_path, exclude):
+    # The database, deps and .storage can be huge, find prunes them so
+    # they are never read, let alone hashed
+    patterns = ' -o '.join(['-path {}'.format(shlex.quote('./' + p)) for p in exclude])
+    prune = '\\( {} \\) -prune -o '.format(patterns) if exclude else ''
+
+    return 'cd {} && find . {}-type f -print0 | xargs -0 -r sha256sum'.format(config_path, prune)
+
+def get_config_manifest(config_path, exclude):
+    result = run(get_manifest_cmd(config_path, exclude), quiet=True)
+    manifest = {}
+
+    for line in result.splitlines():
+        if len(line) > 66:
+            path = line[66:]
+            path = path[2:] if path.startswith('./') else path
+
+            if not is_excluded(path, exclude):
+                manifest[path] = line[:64]
+
+    return manifest
+
+def classify_changes(paths, reload_services):
+    # Files HA reloads on its own need a service call, anything unknown
+    # needs a restart and files mapped to null need nothing at all
+    actions = []
+
+    for path in paths:
+        matches = [p for p in sorted(reload_services) if fnmatch.fnmatch(path, p)]
+        action = reload_services[matches[0]] if matches else RESTART
+
+        if action and action not in actions:
+            actions.append(action)
+
+    if RESTART in actions:
+        return [RESTART]
+
+    return actions
+
+
+# Upload functions
+# --------------------------------------------------------------------------
+def upload_archive(local_dir, config_path, paths):
+    with tempfile.TemporaryFile() as archive:
+        with tarfile.open(fileobj=archive, mode='w') as tar:
+            for path in paths:
+                tar.add(os.path.join(local_dir, path), arcname=path)
+
+        archive.seek(0)
+        cmd = 'tar xf - -C {}'.format(config_path)
+
+        return stream(cmd, source=archive)
+
+def sync_config(local_dir, config_path, settings):
+    exclude = settings['exclude']
+    local = get_local_manifest(local_dir, exclude)
+    remote = get_config_manifest(config_path, exclude)
+    changed = sorted([path for path in local if remote.get(path) != local[path]])
+    small = []
+
+    print('[%s] config sync: %d of %d files changed' % (env.host_string, len(changed), len(local)))
+
+    for path in changed:
+        local_path = os.path.join(local_dir, path)
+        size = os.path.getsize(local_path)
+
+        # Large files the host already has, like known_devices.yaml, go
+        # as a block delta and everything else in one archive
+        if path not in remote or size < settings['delta_min_size']:
+            small.append(path)
+            continue
+
+        with open(local_path, 'rb') as file_data:
+            content = file_data.read()
+
+        spec = {'sudo': False, 'mode': oct(os.stat(local_path).st_mode & 0o777)[2:]}
+        result = run_routine(upload_delta(fabric_session, os.path.join(config_path, path), content, spec, settings['block_size']))
+
+        if result.failed:
+            small.append(path)
+
+    if small:
+        result = upload_archive(local_dir, config_path, small)
+
+        if result.failed:
+            raise DeployException('Could not upload the config to %s' % (env.host_string))
+
+    stale = sorted([path for path in remote if path not in local])
+
+    if stale:
+        print('[%s] config sync: %d files only on the host: %s' % (env.host_string, len(stale), ' '.join(stale[:10])))
+
+    return changed
+
+
+# Reload functions
+# --------------------------------------------------------------------------
+def call_service(service, port, token):
+    domain, name = service.split('.', 1)
+    path = '/api/services/{}/{}'.format(domain, name)
+
+    if is_planning():
+        record('api', 'POST {}'.format(path), 'local')
+        return True
+
+    address = normalize(env.host_string)[1]
+    request = urllib.request.Request('http://{}:{}{}'.format(address, port, path), data=b'{}', method='POST')
+    request.add_header('Content-Type', 'application/json')
+    request.add_header('Authorization', 'Bearer {}'.format(token))
+
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            response.read()
+    except OSError as e:
+        print('[%s] %s failed: %s' % (env.host_string, service, e))
+        return False
+
+    print('[%s] called %s' % (env.host_string, service))
+
+    return True
+
+def reload_config(changed, settings, port, get_token):
+    # Returns True when only a restart picks up the changes
+    actions = classify_changes(changed, settings['reload_services'])
+
+    if RESTART in actions:
+        return True
+
+    for service in actions:
+        if not call_service(service, port, get_token()):
+            return True
+
+    return False
@@ -7,53 +7,86 @@
 # --------------------------------------|~~~~~~~~|--------------------------------------
 
 
-from getpass import getpass
-from fabric.api import sudo, run, env
+import shlex
+
+from fabric.api import env
+
+from session import sudo
+from plan import is_planning
+from plan import record
+from facts import get_facts
+from facts import save_facts
+from packages import get_missing_packages
+from packages import needs_apt_update
+from packages import record_apt_update
+from packages import record_installed
 
 
 # Helper functions
 # --------------------------------------------------------------------------
-def install_native(packages):
-    cmd = 'apt-get update'
-    sudo(cmd)
+def install_native(packages, update=False):
+    # Stages can run concurrently so apt is serialized with a host lock
+    apt_lock = 'flock /var/lock/ha_deploy_apt.lock'
+    facts = get_facts()
+    missing = get_missing_packages(packages, facts)
+
+    if update or (missing and needs_apt_update(facts, env.apt_update_max_age)):
+        cmd = '%s apt-get update' % (apt_lock)
+        result = sudo(cmd, tail=True)
+
+        if result.succeeded:
+            record_apt_update(facts)
+
+    if not missing:
+        if packages:
+            print('[%s] packages already installed: %s' % (env.host_string, ' '.join(packages)))
 
-    cmd = 'apt-get -qy --allow-unauthenticated install %s' % ' '.join(packages)
-    sudo(cmd)
+        save_facts(facts)
+        return
 
-def get_passwd(username):
-    tries = 3
-    first_pw = getpass('Enter password for %s: ' % (username))
-    second_pw = getpass('Renter the password for %s: ' % (username))
+    cmd = '%s apt-get -qy --allow-unauthenticated install %s' % (apt_lock, ' '.join(missing))
+    result = sudo(cmd, tail=True)
 
-    for _ in range(tries):
-        if first_pw == second_pw:
-            return first_pw
+    if result.succeeded:
+        record_installed(facts, missing)
 
-    raise ValueError
+    save_facts(facts)
+
+def get_append_cmd(line, path):
+    # Tasks rerun whenever their fingerprint changes, a line that is
+    # already there is left alone
+    line = shlex.quote(line)
+
+    return 'grep -qxF -- {0} {1} 2>/dev/null || echo {0} >> {1}'.format(line, path)
 
 def get_user_home_dir(username):
     path = None
+    users = get_facts()['users']
+
+    # The user may have been created since the facts were gathered
+    if username not in users:
+        users = get_facts(refresh=True)['users']
 
-    cmd = 'grep {} /etc/passwd'.format(username)
-    output = run(cmd)
-    tokens = output.split(':')
+    if username in users:
+        path = users[username]['home']
+    elif is_planning():
+        # Planned users are only created in the plan, useradd -m puts
+        # their home here
+        path = '/home/%s' % (username)
 
-    if len(tokens) > 5:
-        path = tokens[5]
-   
     return path
 
-def get_passwords(users):
-    for user in users:
-    	if not user.password:
-	        try:
-	            user.password = get_passwd(user.name)
-	        except ValueError:
-	            pass
-
-def switch_user(user, password):
-    env.user = user
-    env.password = password
+def switch_user(user, password, login=False):
+    # With a single session the first login is kept and later users are
+    # reached through sudo -u instead of a new ssh authentication
+    if login or not env.get('single_session') or not env.get('session_user'):
+        env.user = user
+        env.password = password
+
+    env.session_user = user
+
+    if is_planning():
+        record('user', user, env.user)
 
 def get_ha_user(user_info):
     users = user_info['accounts']
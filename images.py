@@ -0,0 +1,191 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import io
+import json
+import fcntl
+import shutil
+import tarfile
+import tempfile
+import subprocess
+
+from fabric.api import env
+
+from facts import get_facts
+from session import run
+from session import stream
+
+
+IMAGE_MARKER = '.image'
+
+
+# Local store functions
+# --------------------------------------------------------------------------
+def get_image_path(*parts):
+    return os.path.join(env.cache_dir, 'images', *parts)
+
+def get_image_name(prefix, version):
+    return '{}-{}-{}.tar.zst'.format(prefix, get_facts()['arch'], version)
+
+def get_manifest_path(name):
+    return get_image_path('%s.json' % (name))
+
+def has_image(name):
+    return os.path.exists(get_image_path(name)) and os.path.exists(get_manifest_path(name))
+
+def load_manifest(name):
+    path = get_manifest_path(name)
+
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as manifest_data:
+        return json.load(manifest_data)
+
+def save_manifest(name, manifest):
+    with open(get_manifest_path(name), 'w') as manifest_data:
+        json.dump(manifest, manifest_data, indent=4, sort_keys=True)
+
+def get_changes(old, new):
+    changed = [path for path in new if old.get(path) != new[path]]
+    removed = [path for path in old if path not in new]
+
+    return sorted(changed), sorted(removed)
+
+def build_delta(name, changed, delta_file):
+    # Copy only the changed files into a new archive, directories and
+    # links are tiny so they always go along
+    decompress = subprocess.Popen(['zstd', '-q', '-dc', get_image_path(name)], stdout=subprocess.PIPE)
+    compress = subprocess.Popen(['zstd', '-q', '-c', '-%d' % (env.image_settings['level'])], stdin=subprocess.PIPE, stdout=delta_file)
+    changed = set(changed)
+
+    with tarfile.open(fileobj=decompress.stdout, mode='r|') as image:
+        with tarfile.open(fileobj=compress.stdin, mode='w|') as delta:
+            for member in image:
+                if not member.isfile():
+                    delta.addfile(member)
+                elif member.name in changed:
+                    delta.addfile(member, image.extractfile(member))
+
+    compress.stdin.close()
+
+    return decompress.wait() == 0 and compress.wait() == 0
+
+
+# Remote functions
+# --------------------------------------------------------------------------
+def get_remote_manifest(dest, dirs):
+    cmd = 'cd {} && find {} -type f -print0 | xargs -0 -r sha256sum'.format(dest, ' '.join(dirs))
+    result = run(cmd, quiet=True)
+    manifest = {}
+
+    for line in result.splitlines():
+        if len(line) > 66:
+            manifest[line[66:]] = line[:64]
+
+    return manifest
+
+def get_installed_image(dest):
+    cmd = 'cat {}'.format(os.path.join(dest, IMAGE_MARKER))
+    result = run(cmd, quiet=True)
+
+    if result.failed:
+        return None
+
+    return result.strip()
+
+def capture_image(name, dest, dirs):
+    image_path = get_image_path(name)
+    partial_path = image_path + '.partial'
+
+    if not os.path.exists(get_image_path()):
+        os.makedirs(get_image_path())
+
+    print('[%s] capturing image %s' % (env.host_string, name))
+
+    # Only the exit code of the last command in a pipe survives in sh,
+    # so tar reports through a file
+    cmd = 's=$(mktemp) && cd {0} && {{ tar cf - {1}; echo $? > $s; }} | zstd -q -T0 -{2} -c && rc=$(cat $s); rm -f $s; exit ${{rc:-1}}'.format(dest, ' '.join(dirs), env.image_settings['level'])
+
+    with open(partial_path, 'wb') as image:
+        result = stream(cmd, sink=image)
+
+    if result.failed:
+        os.remove(partial_path)
+        return result
+
+    save_manifest(name, get_remote_manifest(dest, dirs))
+    os.rename(partial_path, image_path)
+
+    cmd = 'echo {} > {}'.format(name, os.path.join(dest, IMAGE_MARKER))
+
+    return run(cmd)
+
+def install_image(name, dest):
+    current = get_installed_image(dest)
+    old = load_manifest(current) if current else None
+    cmd = 'mkdir -p {0} && zstd -q -dc | tar xf - -C {0}'.format(dest)
+    removed = []
+
+    if current == name:
+        print('[%s] image %s is already installed' % (env.host_string, name))
+        return
+
+    with tempfile.TemporaryFile() as delta:
+        # Updates from a known image only ship what changed, building
+        # the delta needs zstd on this machine too
+        if old is not None and shutil.which('zstd'):
+            changed, removed = get_changes(old, load_manifest(name))
+
+            if build_delta(name, changed, delta):
+                print('[%s] updating %s to image %s, %d changed and %d removed files' % (env.host_string, current, name, len(changed), len(removed)))
+                delta.seek(0)
+                result = stream(cmd, source=delta)
+            else:
+                old = None
+                removed = []
+
+        if old is None or not shutil.which('zstd'):
+            print('[%s] installing image %s' % (env.host_string, name))
+
+            with open(get_image_path(name), 'rb') as image:
+                result = stream(cmd, source=image)
+
+    if result.failed:
+        return result
+
+    if removed:
+        listing = io.BytesIO(('\n'.join(removed) + '\n').encode('utf-8'))
+        stream('cd {} && xargs -d "\\n" rm -f --'.format(dest), source=listing)
+
+    cmd = 'echo {} > {}'.format(name, os.path.join(dest, IMAGE_MARKER))
+
+    return run(cmd)
+
+def provision_from_image(name, dest, dirs, build):
+    # An image only pays off when other hosts unpack it, a single host
+    # just builds in place
+    if not env.image_settings['enable']:
+        return build()
+
+    if not os.path.exists(get_image_path()):
+        os.makedirs(get_image_path())
+
+    # Hold a lock while building so the other hosts in a fleet run wait
+    # for the first image instead of assembling the same tree
+    with open(get_image_path(name) + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        if has_image(name):
+            return install_image(name, dest)
+
+        build()
+
+        return capture_image(name, dest, dirs)
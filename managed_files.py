@@ -0,0 +1,239 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import hashlib
+from string import Template
+
+from helper import get_ha_user
+from data_structures import DeployException
+
+
+DELTA_HELPER_SRC    = './files/delta.py'
+DELTA_HELPER        = '/var/cache/ha_deploy/delta.py'
+DELTA_HELPER_SPEC   = {'owner': 'root', 'mode': '0755'}
+MODULUS             = 1 << 16
+
+
+# Render functions
+# --------------------------------------------------------------------------
+def get_template_values(config, prefix=''):
+    # Nested sections flatten to ${section_key}, lists and users are left out
+    values = {}
+
+    for key, value in config.items():
+        name = prefix + key
+
+        if isinstance(value, dict):
+            values.update(get_template_values(value, name + '_'))
+        elif isinstance(value, (str, int, float, bool)):
+            values[name] = value
+
+    return values
+
+def render_file(spec, values):
+    with open(spec['src'], 'rb') as src:
+        content = src.read()
+
+    if spec.get('template'):
+        content = Template(content.decode('utf-8')).safe_substitute(values).encode('utf-8')
+
+    return content
+
+def get_dest(spec, values):
+    return Template(spec['dest']).safe_substitute(values)
+
+
+# Delta functions
+# --------------------------------------------------------------------------
+def parse_signature(result):
+    blocks = {}
+
+    for index, line in enumerate(result.splitlines()):
+        weak, strong = line.split()
+        blocks.setdefault(int(weak), {}).setdefault(strong, index)
+
+    return blocks
+
+def build_delta(content, blocks, block_size):
+    # rsync style, a rolling checksum finds blocks the host already has
+    # at any offset and only the bytes in between are sent
+    ops = []
+    literal = bytearray()
+    length = len(content)
+    pos = 0
+    a = None
+
+    def flush():
+        if literal:
+            ops.append(b'D %d\n' % (len(literal)) + bytes(literal))
+            del literal[:]
+
+    while pos + block_size <= length:
+        if a is None:
+            block = content[pos:pos + block_size]
+            a = sum(block) % MODULUS
+            b = sum([(block_size - i) * x for i, x in enumerate(block)]) % MODULUS
+
+        candidates = blocks.get(a + (b << 16))
+
+        if candidates:
+            strong = hashlib.md5(content[pos:pos + block_size]).hexdigest()
+
+            if strong in candidates:
+                flush()
+                ops.append(b'C %d\n' % (candidates[strong]))
+                pos += block_size
+                a = None
+                continue
+
+        out = content[pos]
+        literal.append(out)
+
+        if pos + block_size < length:
+            a = (a - out + content[pos + block_size]) % MODULUS
+            b = (b - block_size * out + a) % MODULUS
+
+        pos += 1
+
+    literal.extend(content[pos:])
+    flush()
+
+    return b''.join(ops)
+
+
+# Remote functions
+# --------------------------------------------------------------------------
+def get_hash_cmd(paths):
+    return 'sha256sum {} 2>/dev/null; true'.format(' '.join(paths))
+
+def parse_hashes(result):
+    hashes = {}
+
+    for line in result.splitlines():
+        tokens = line.split()
+
+        if len(tokens) == 2:
+            hashes[tokens[1]] = tokens[0]
+
+    return hashes
+
+def get_remote_hashes(session, paths, use_sudo=True):
+    cmd = get_hash_cmd(paths)
+    result = yield session.sudo(cmd, quiet=True) if use_sudo else session.run(cmd, quiet=True)
+
+    return parse_hashes(result)
+
+def get_install_cmd(dest, spec):
+    cmds = []
+
+    if spec.get('owner'):
+        cmds.append('chown {0}:{0} {1}.new'.format(spec['owner'], dest))
+
+    cmds.append('chmod {} {}.new'.format(spec.get('mode', '0644'), dest))
+    cmds.append('mv -f {0}.new {0}'.format(dest))
+
+    return ' && '.join(cmds)
+
+def get_upload_cmd(dest, spec):
+    return 'mkdir -p {0} && cat > {1}.new && {2}'.format(os.path.dirname(dest), dest, get_install_cmd(dest, spec))
+
+def get_signature_cmd(dest, block_size):
+    return 'python3 {} signature {} {}'.format(DELTA_HELPER, dest, block_size)
+
+def get_patch_cmd(dest, content, spec, block_size):
+    digest = hashlib.sha256(content).hexdigest()
+
+    return 'python3 {0} patch {1} {1}.new {2} {3} && {4}'.format(DELTA_HELPER, dest, digest, block_size, get_install_cmd(dest, spec))
+
+def read_delta_helper():
+    with open(DELTA_HELPER_SRC, 'rb') as helper:
+        return helper.read()
+
+def upload_full(session, dest, content, spec):
+    return (yield session.stream(get_upload_cmd(dest, spec), content, spec.get('sudo', True)))
+
+def install_delta_helper(session, remote_hash=None):
+    content = read_delta_helper()
+
+    if remote_hash is None:
+        remote = yield from get_remote_hashes(session, [DELTA_HELPER])
+        remote_hash = remote.get(DELTA_HELPER)
+
+    digest = hashlib.sha256(content).hexdigest()
+
+    if remote_hash != digest:
+        yield from upload_full(session, DELTA_HELPER, content, DELTA_HELPER_SPEC)
+
+    return digest
+
+def upload_delta(session, dest, content, spec, block_size):
+    use_sudo = spec.get('sudo', True)
+    cmd = get_signature_cmd(dest, block_size)
+    result = yield session.sudo(cmd, quiet=True) if use_sudo else session.run(cmd, quiet=True)
+
+    if result.failed:
+        return result
+
+    delta = yield session.call(build_delta, content, parse_signature(result), block_size)
+    print('[%s] sending %s as a %d byte delta of %d bytes' % (session.host, dest, len(delta), len(content)))
+
+    cmd = get_patch_cmd(dest, content, spec, block_size)
+
+    return (yield session.stream(cmd, delta, use_sudo))
+
+def render_files(names, values, settings):
+    specs = dict([(name, settings['files'][name]) for name in names])
+    dests = dict([(name, get_dest(specs[name], values)) for name in names])
+    contents = dict([(name, render_file(specs[name], values)) for name in names])
+
+    return specs, dests, contents
+
+def use_delta(dest, content, spec, remote, settings):
+    # Installing the delta helper needs root, so only sudo files use deltas
+    return dest in remote and spec.get('sudo', True) and len(content) >= settings['delta_min_size']
+
+def get_file_values(config):
+    values = get_template_values(config)
+    values['ha_user'] = get_ha_user(config['user']).name
+
+    return values
+
+def sync_files(session, names, values, settings):
+    specs, dests, contents = render_files(names, values, settings)
+    use_sudo = any([spec.get('sudo', True) for spec in specs.values()])
+
+    # One checksum query covers every file and the delta helper
+    remote = yield from get_remote_hashes(session, sorted(dests.values()) + [DELTA_HELPER], use_sudo)
+    changed = []
+
+    for name in names:
+        dest = dests[name]
+        content = contents[name]
+        spec = specs[name]
+
+        if remote.get(dest) == hashlib.sha256(content).hexdigest():
+            continue
+
+        result = None
+
+        if use_delta(dest, content, spec, remote, settings):
+            remote[DELTA_HELPER] = yield from install_delta_helper(session, remote.get(DELTA_HELPER))
+            result = yield from upload_delta(session, dest, content, spec, settings['block_size'])
+
+        if result is None or result.failed:
+            print('[%s] uploading %s' % (session.host, dest))
+            result = yield from upload_full(session, dest, content, spec)
+
+        if result.failed:
+            raise DeployException('Could not upload %s to %s' % (dest, session.host))
+
+        changed.append(name)
+
+    return changed
@@ -0,0 +1,63 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import time
+
+
+PACKAGE_SECTIONS = [    ['system_apps'],
+                        ['python_system_libs'],
+                        ['openzwave', 'system_libs'],
+                        ['libmicrohttpd', 'system_libs'],
+                        ['mqtt', 'system_libs'],
+                        ['firewall', 'system_libs'],
+                        ['build', 'system_libs'],
+                        ['images', 'system_libs']  ]
+
+
+# Planner functions
+# --------------------------------------------------------------------------
+def plan_packages(config):
+    packages = []
+
+    for keys in PACKAGE_SECTIONS:
+        section = config
+
+        for key in keys:
+            section = section.get(key, {})
+
+        if keys[0] == 'firewall' and not config['firewall']['enable']:
+            continue
+
+        if keys[0] == 'images' and not config['images']['enable']:
+            continue
+
+        for package in section or []:
+            if package not in packages:
+                packages.append(package)
+
+    return packages
+
+def get_missing_packages(packages, facts):
+    # dpkg reports package names in lower case
+    installed = set(facts['packages'])
+
+    return [p for p in packages if p.lower() not in installed]
+
+def needs_apt_update(facts, max_age):
+    updated_at = facts.get('apt_updated_at')
+
+    return updated_at is None or time.time() - updated_at > max_age
+
+def record_apt_update(facts):
+    facts['apt_updated_at'] = time.time()
+
+def record_installed(facts, packages):
+    for package in packages:
+        if package.lower() not in facts['packages']:
+            facts['packages'].append(package.lower())
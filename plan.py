@@ -0,0 +1,153 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import difflib
+
+from fabric.api import env
+from fabric.network import normalize
+from fabric.operations import _AttributeList
+from fabric.operations import _AttributeString
+from fabric.operations import _prefix_commands
+from fabric.operations import _prefix_env_vars
+
+
+PLAN_SUFFIX = '.plan'
+
+
+# Recording functions
+# --------------------------------------------------------------------------
+def is_planning():
+    return env.get('plan') is not None
+
+def get_plan_user(op, sudo_user=None):
+    if op == 'sudo':
+        return sudo_user or 'root'
+
+    if env.get('single_session') and env.get('session_user'):
+        return env.session_user
+
+    return env.user
+
+def record(op, text, user=None):
+    env.plan.append('{:<8} {:<16} {}'.format(op, user or get_plan_user(op), text))
+
+def record_command(op, cmd, quiet=False, sudo_user=None):
+    # Commands are recorded the way fabric would send them, with the
+    # current cd() and prefix() applied
+    record(op, _prefix_commands(_prefix_env_vars(cmd), 'remote'), get_plan_user(op, sudo_user))
+
+    # Quiet commands are probes, a plan assumes the answer is no and
+    # shows the full path the deploy could take
+    result = _AttributeString('')
+    result.return_code = 1 if quiet else 0
+    result.failed = quiet
+    result.succeeded = not quiet
+    result.stderr = ''
+
+    return result
+
+def record_put(local_path, remote_path, use_sudo=False):
+    name = getattr(local_path, 'name', local_path)
+    record('put', '{} -> {}'.format(name, remote_path), 'root' if use_sudo else None)
+
+    result = _AttributeList([remote_path])
+    result.failed = []
+    result.succeeded = True
+
+    return result
+
+def record_stream(cmd, sink=None, use_sudo=False, user=None):
+    # Nothing comes back from a plan, so downloads fail and callers
+    # throw away their partial files
+    op = 'download' if sink is not None else 'stream'
+    record(op, _prefix_commands(_prefix_env_vars(cmd), 'remote'), (user or 'root') if use_sudo else None)
+
+    result = _AttributeString('')
+    result.return_code = 1 if sink is not None else 0
+    result.failed = sink is not None
+    result.succeeded = not result.failed
+
+    return result
+
+
+# Plan files
+# --------------------------------------------------------------------------
+def get_plan_dir(host):
+    return os.path.join(env.cache_dir, 'plans', normalize(host)[1])
+
+def get_previous_plan(host):
+    plan_dir = get_plan_dir(host)
+
+    if not os.path.exists(plan_dir):
+        return None
+
+    current = env.deploy_id + PLAN_SUFFIX
+    names = [n for n in sorted(os.listdir(plan_dir)) if n.endswith(PLAN_SUFFIX) and n < current]
+
+    return os.path.join(plan_dir, names[-1]) if names else None
+
+def save_plan(host, lines):
+    plan_dir = get_plan_dir(host)
+
+    if not os.path.exists(plan_dir):
+        os.makedirs(plan_dir)
+
+    path = os.path.join(plan_dir, env.deploy_id + PLAN_SUFFIX)
+
+    with open(path, 'w') as plan_data:
+        plan_data.write('\n'.join(lines) + '\n')
+
+    return path
+
+def print_plan_diff(host, lines, path):
+    previous = get_previous_plan(host)
+    count = len([line for line in lines if not line.startswith('#')])
+
+    print('')
+    print('[%s] %d planned steps written to %s' % (host, count, path))
+
+    if previous is None:
+        print('[%s] no earlier plan to compare with' % (host))
+        return
+
+    with open(previous) as plan_data:
+        old = plan_data.read().splitlines()
+
+    diff = list(difflib.unified_diff(old, lines, previous, path, lineterm=''))
+
+    if not diff:
+        print('[%s] unchanged since %s' % (host, os.path.basename(previous)))
+
+    for line in diff:
+        print(line)
+
+def plan_task(func):
+    def planned(*args, **kwargs):
+        env.plan = []
+        error = None
+
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            error = e
+            env.plan.append('# error: %s: %s' % (e.__class__.__name__, e))
+        finally:
+            lines = env.plan
+            env.plan = None
+
+        path = save_plan(env.host_string, lines)
+        print_plan_diff(env.host_string, lines, path)
+
+        if error is not None:
+            raise error
+
+    planned.__name__ = getattr(func, 'name', func.__name__)
+
+    return planned
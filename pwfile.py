@@ -0,0 +1,119 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import base64
+import hashlib
+import multiprocessing
+
+
+SALT_SIZE           = 12
+PARALLEL_THRESHOLD  = 1000
+PID_FILE            = '/var/run/mosquitto.pid'
+RELOAD_CMD          = '[ ! -f {0} ] || kill -HUP $(cat {0})'.format(PID_FILE)
+
+
+# Hash functions
+# --------------------------------------------------------------------------
+def hash_password(password, salt=None):
+    # mosquitto_passwd format, sha512 over the password and a random
+    # salt with both base64 encoded
+    salt = salt or os.urandom(SALT_SIZE)
+    digest = hashlib.sha512(password.encode('utf-8') + salt).digest()
+
+    return '$6${}${}'.format(base64.b64encode(salt).decode('ascii'), base64.b64encode(digest).decode('ascii'))
+
+def check_password(password, hashed):
+    tokens = hashed.split('$')
+
+    if len(tokens) != 4 or tokens[1] != '6':
+        return False
+
+    try:
+        salt = base64.b64decode(tokens[2])
+    except ValueError:
+        return False
+
+    return hash_password(password, salt) == hashed
+
+def hash_entry(entry):
+    name, password, existing = entry
+
+    # Keeping a hash that still matches leaves the file unchanged, so
+    # an unchanged user list never reloads the broker
+    if existing and check_password(password, existing):
+        return '%s:%s' % (name, existing)
+
+    return '%s:%s' % (name, hash_password(password))
+
+
+# Pwfile functions
+# --------------------------------------------------------------------------
+def parse_pwfile(text):
+    entries = {}
+
+    for line in text.splitlines():
+        name, _, hashed = line.strip().partition(':')
+
+        if name and hashed:
+            entries[name] = hashed
+
+    return entries
+
+def render_pwfile(users, existing, can_fork=True):
+    entries = [(u.name, u.password, existing.get(u.name)) for u in users]
+
+    # Forking a process that runs other threads can leave the child stuck
+    # on a lock it will never get, those callers hash serially
+    if len(entries) < PARALLEL_THRESHOLD or not can_fork:
+        lines = [hash_entry(entry) for entry in entries]
+    else:
+        with multiprocessing.get_context('fork').Pool() as pool:
+            lines = pool.map(hash_entry, entries, chunksize=256)
+
+    return '\n'.join(lines) + '\n'
+
+def clean_pwfile(result):
+    if result.failed:
+        return ''
+
+    return result.replace('\r\n', '\n')
+
+def read_pwfile(session, path):
+    result = yield session.sudo('cat {}'.format(path), quiet=True)
+
+    return clean_pwfile(result)
+
+def is_current(content, current):
+    # Fabric strips the trailing newline from command output
+    return content.strip() == current.strip()
+
+def get_upload_cmd(path, owner):
+    # Passwords never reach a command line, the file arrives on stdin and
+    # replaces the old one in a single rename
+    return 'cat > {0}.new && chown {1}:{1} {0}.new && chmod 0600 {0}.new && mv -f {0}.new {0}'.format(path, owner)
+
+def sync_pwfile(session, path, users, owner):
+    current = yield from read_pwfile(session, path)
+    content = yield session.call(render_pwfile, users, parse_pwfile(current), session.can_fork)
+
+    if is_current(content, current):
+        print('[%s] %s is up to date for %d users' % (session.host, path, len(users)))
+        return False
+
+    print('[%s] uploading %s for %d users' % (session.host, path, len(users)))
+
+    result = yield session.stream(get_upload_cmd(path, owner), content.encode('utf-8'), True)
+
+    if result.failed:
+        return False
+
+    yield session.sudo(RELOAD_CMD)
+
+    return True
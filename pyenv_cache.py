@@ -0,0 +1,86 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import fcntl
+import hashlib
+
+from fabric.api import env
+
+from facts import get_facts
+from facts import save_facts
+from build import timed_build
+from session import stream
+
+
+# Artifact functions
+# --------------------------------------------------------------------------
+def get_artifact_name(version, facts, build_deps):
+    deps = hashlib.sha256(' '.join(sorted(build_deps)).encode('utf-8')).hexdigest()[:12]
+
+    return 'python-{}-{}-libc{}-{}.tar.gz'.format(version, facts['arch'], facts['libc'], deps)
+
+def get_artifact_path(name):
+    return os.path.join(env.cache_dir, 'python', name)
+
+def upload_interpreter(artifact_path, pyenv_root):
+    versions_path = os.path.join(pyenv_root, 'versions')
+    cmd = 'mkdir -p {0} && tar xzf - -C {0}'.format(versions_path)
+
+    with open(artifact_path, 'rb') as artifact:
+        return stream(cmd, source=artifact, use_sudo=True)
+
+def download_interpreter(artifact_path, pyenv_root, version):
+    versions_path = os.path.join(pyenv_root, 'versions')
+    cmd = 'tar czf - -C {} {}'.format(versions_path, version)
+    partial_path = artifact_path + '.partial'
+
+    with open(partial_path, 'wb') as artifact:
+        result = stream(cmd, sink=artifact, use_sudo=True)
+
+    if result.succeeded:
+        os.rename(partial_path, artifact_path)
+    else:
+        os.remove(partial_path)
+
+    return result
+
+def install_interpreter(version, pyenv_root, build_deps):
+    facts = get_facts()
+    installed = facts['pyenv'].setdefault(pyenv_root, [])
+
+    if version in installed:
+        print('[%s] python %s already installed in %s' % (env.host_string, version, pyenv_root))
+        return
+
+    name = get_artifact_name(version, facts, build_deps)
+    artifact_path = get_artifact_path(name)
+
+    if not os.path.exists(os.path.dirname(artifact_path)):
+        os.makedirs(os.path.dirname(artifact_path))
+
+    # Hold a lock while building so the other hosts in a fleet run wait
+    # for the first build instead of compiling the same interpreter
+    with open(artifact_path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        if os.path.exists(artifact_path):
+            result = upload_interpreter(artifact_path, pyenv_root)
+        else:
+            cmd = 'pyenv install %s' % (version)
+            result = timed_build('python-%s' % (version), cmd, use_sudo=True)
+
+            if result.succeeded:
+                download_interpreter(artifact_path, pyenv_root, version)
+
+    if result.succeeded:
+        installed.append(version)
+        save_facts(facts)
+
+    return result
@@ -0,0 +1,191 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import json
+import time
+import random
+import socket
+import asyncio
+
+from fabric.api import env
+from fabric.network import normalize
+
+from plan import is_planning
+from plan import record
+
+
+MAX_DELAY = 2.0
+
+
+# Probe definitions
+# --------------------------------------------------------------------------
+def get_port(rule):
+    # ufw rules are either 'port/proto' or a service name from /etc/services
+    port = rule.split('/')[0]
+
+    if port.isdigit():
+        return int(port)
+
+    try:
+        return socket.getservbyname(port, 'tcp')
+    except OSError:
+        return None
+
+def get_probes(config, names=None):
+    readiness = config['readiness']
+    probes = []
+
+    for name, probe in sorted(readiness['probes'].items()):
+        if names is None or name in names:
+            probes.append({ 'name':     name,
+                            'port':     probe['port'],
+                            'path':     probe.get('path'),
+                            'required': probe.get('required', True) })
+
+    if names is not None or not config['firewall']['enable']:
+        return probes
+
+    # Opened ports are reported too, but nothing has to listen on them
+    ports = [probe['port'] for probe in probes]
+
+    for rule in config['firewall']['allowed']:
+        port = get_port(rule)
+
+        if port and port not in ports:
+            ports.append(port)
+            probes.append({ 'name':     rule,
+                            'port':     port,
+                            'path':     None,
+                            'required': False   })
+
+    return probes
+
+
+# Probe functions
+# --------------------------------------------------------------------------
+async def probe_once(address, probe, timeout):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(address, probe['port']), timeout)
+
+    try:
+        if not probe['path']:
+            return True
+
+        # Any status line means the server is answering, even a 401
+        request = 'GET {} HTTP/1.0\r\nHost: {}\r\n\r\n'.format(probe['path'], address)
+        writer.write(request.encode('utf-8'))
+        await writer.drain()
+        line = await asyncio.wait_for(reader.readline(), timeout)
+
+        return line.startswith(b'HTTP/')
+    finally:
+        writer.close()
+
+async def wait_ready(address, probe, started_at, timeout, limit):
+    deadline = started_at + timeout
+    delay = 0.1
+
+    while time.time() < deadline:
+        try:
+            async with limit:
+                if await probe_once(address, probe, min(2.0, timeout)):
+                    return time.time() - started_at
+        except (OSError, asyncio.TimeoutError):
+            pass
+
+        # Jitter keeps a fleet of probes from hitting the hosts in lockstep
+        await asyncio.sleep(min(delay * random.uniform(0.5, 1.5), max(0.0, deadline - time.time())))
+        delay = min(delay * 2, MAX_DELAY)
+
+    return None
+
+async def probe_hosts(hosts, probes, started_at, settings):
+    limit = asyncio.Semaphore(settings['concurrency'])
+    jobs = []
+
+    for host in hosts:
+        address = normalize(host)[1]
+
+        for probe in probes:
+            timeout = settings['timeout'] if probe['required'] else settings['optional_timeout']
+            jobs.append(wait_ready(address, probe, started_at, timeout, limit))
+
+    elapsed = await asyncio.gather(*jobs)
+    results = {}
+
+    for index, host in enumerate(hosts):
+        results[host] = []
+
+        for offset, probe in enumerate(probes):
+            result = dict(probe)
+            result['time_to_ready'] = elapsed[index * len(probes) + offset]
+            results[host].append(result)
+
+    return results
+
+def check_readiness(hosts, probes, settings, started_at=None):
+    started_at = started_at or time.time()
+    loop = asyncio.new_event_loop()
+
+    try:
+        return loop.run_until_complete(probe_hosts(hosts, probes, started_at, settings))
+    finally:
+        loop.close()
+
+
+# Report functions
+# --------------------------------------------------------------------------
+def record_readiness(results):
+    for host, probes in results.items():
+        path = os.path.join(env.cache_dir, 'readiness', '%s.jsonl' % (normalize(host)[1]))
+
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        with open(path, 'a') as readiness_data:
+            for probe in probes:
+                record = {  'deploy':           env.get('deploy_id'),
+                            'host':             host,
+                            'service':          probe['name'],
+                            'port':             probe['port'],
+                            'required':         probe['required'],
+                            'time_to_ready':    probe['time_to_ready']  }
+
+                readiness_data.write(json.dumps(record, sort_keys=True) + '\n')
+
+def print_readiness(results):
+    width = max([len(host) for host in results] + [len('HOST')])
+    row = '{:<%d}  {:<16}  {:>5}  {:>9}' % (width)
+    failed = []
+
+    print('')
+    print(row.format('HOST', 'SERVICE', 'PORT', 'READY (s)'))
+
+    for host in sorted(results):
+        for probe in results[host]:
+            elapsed = probe['time_to_ready']
+            ready = '%.1f' % (elapsed) if elapsed is not None else '-'
+            print(row.format(host, probe['name'], probe['port'], ready))
+
+            if elapsed is None and probe['required']:
+                failed.append('%s:%s' % (host, probe['name']))
+
+    return failed
+
+def wait_for_services(hosts, probes, settings, started_at=None):
+    if is_planning():
+        for probe in probes:
+            record('probe', '{}:{}{}'.format(probe['name'], probe['port'], probe['path'] or ''), 'local')
+
+        return []
+
+    results = check_readiness(hosts, probes, settings, started_at)
+    record_readiness(results)
+
+    return print_readiness(results)
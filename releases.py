@@ -0,0 +1,202 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import json
+import time
+import socket
+
+from fabric.api import env
+from fabric.network import normalize
+
+from session import run, sudo
+from fingerprint import compute_fingerprint
+from data_structures import DeployException
+from plan import is_planning
+
+
+RELEASES_DIR    = 'releases'
+CURRENT_LINK    = 'current'
+HISTORY_FILE    = 'releases.log'
+RELEASE_INPUTS  = (['home_assistant', 'python', 'images'], [], ['home_assistant.git_src_url'])
+
+planned_releases = {}
+
+
+# Release functions
+# --------------------------------------------------------------------------
+def get_release_name(config):
+    # Hosts with the same inputs share a release name, so the venv paths
+    # baked into a release image are valid everywhere
+    return compute_fingerprint(config, *RELEASE_INPUTS)[:12]
+
+def get_release_path(ha_path, release):
+    return os.path.join(ha_path, RELEASES_DIR, release)
+
+def get_current_path(ha_path):
+    return os.path.join(ha_path, CURRENT_LINK)
+
+def get_active_release(ha_path):
+    # Later steps of a plan see the release an earlier step switched to
+    if is_planning():
+        return planned_releases.get((env.host_string, ha_path))
+
+    cmd = 'readlink -e {}'.format(get_current_path(ha_path))
+    result = run(cmd, quiet=True)
+
+    if result.failed or not result.strip():
+        return None
+
+    return result.strip()
+
+def get_history(ha_path):
+    cmd = 'cat {}'.format(os.path.join(ha_path, HISTORY_FILE))
+    result = run(cmd, quiet=True)
+
+    if result.failed:
+        return []
+
+    return [line.strip() for line in result.splitlines() if line.strip()]
+
+def list_releases(ha_path):
+    cmd = 'ls -1 {}'.format(os.path.join(ha_path, RELEASES_DIR))
+    result = run(cmd, quiet=True)
+
+    if result.failed:
+        return []
+
+    return [line.strip() for line in result.splitlines() if line.strip()]
+
+def seed_release(ha_path, release_path, names):
+    # Start a new release from a copy of the active one so only the
+    # differences have to be fetched
+    for name in names:
+        src = os.path.join(get_current_path(ha_path), name)
+        dest = os.path.join(release_path, name)
+        cmd = '[ -e {1} ] || [ ! -e {0} ] || cp -a {0} {1}'.format(src, dest)
+        run(cmd)
+
+def switch_release(ha_path, release_path):
+    # rename() replaces the link in one step, the service never sees a
+    # missing or half written path
+    current = get_current_path(ha_path)
+    cmd = 'ln -sfn {0} {1}.new && mv -T {1}.new {1}'.format(release_path, current)
+    result = sudo(cmd)
+
+    if result.failed:
+        raise DeployException('Could not switch %s to %s' % (current, release_path))
+
+    if is_planning():
+        planned_releases[(env.host_string, ha_path)] = release_path
+
+    cmd = 'echo {} >> {}'.format(os.path.basename(release_path), os.path.join(ha_path, HISTORY_FILE))
+    sudo(cmd)
+
+def prune_releases(ha_path, keep):
+    history = get_history(ha_path)
+    active = get_active_release(ha_path)
+    kept = []
+
+    for release in reversed(history):
+        if release not in kept and len(kept) < keep:
+            kept.append(release)
+
+    if active:
+        kept.append(os.path.basename(active))
+
+    stale = [r for r in list_releases(ha_path) if r not in kept]
+
+    for release in stale:
+        cmd = 'rm -rf {}'.format(get_release_path(ha_path, release))
+        run(cmd)
+
+    return stale
+
+
+# Service functions
+# --------------------------------------------------------------------------
+def wait_for_port(address, port, timeout):
+    deadline = time.time() + timeout
+    delay = 0.1
+
+    while time.time() < deadline:
+        try:
+            socket.create_connection((address, port), timeout=2).close()
+            return True
+        except (OSError, socket.timeout):
+            time.sleep(delay)
+            delay = min(delay * 2, 2.0)
+
+    return False
+
+def is_active(service):
+    cmd = 'systemctl is-active {}'.format(service)
+
+    return sudo(cmd, quiet=True).strip() == 'active'
+
+def record_release(release, downtime):
+    if is_planning():
+        return
+
+    path = os.path.join(env.cache_dir, 'releases', '%s.jsonl' % (env.host))
+
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    record = {  'host':         env.host,
+                'release':      release,
+                'switched_at':  time.time(),
+                'downtime':     downtime    }
+
+    with open(path, 'a') as release_data:
+        release_data.write(json.dumps(record, sort_keys=True) + '\n')
+
+def activate_release(ha_path, release_path, settings):
+    release = os.path.basename(release_path)
+    active = get_active_release(ha_path)
+
+    if active == release_path:
+        print('[%s] release %s is already active' % (env.host_string, release))
+        return None
+
+    service = settings['service']
+    running = is_active(service)
+    start = time.time()
+    switch_release(ha_path, release_path)
+
+    if not running:
+        print('[%s] switched to release %s' % (env.host_string, release))
+        record_release(release, None)
+        return None
+
+    cmd = 'systemctl restart {}'.format(service)
+    sudo(cmd)
+
+    address = normalize(env.host_string)[1]
+
+    if not wait_for_port(address, settings['port'], settings['ready_timeout']):
+        raise DeployException('%s did not come back on port %d after switching to %s' % (service, settings['port'], release))
+
+    downtime = time.time() - start
+    record_release(release, downtime)
+    print('[%s] switched to release %s, %s was down for %.1fs' % (env.host_string, release, service, downtime))
+
+    return downtime
+
+def rollback_release(ha_path, settings):
+    active = get_active_release(ha_path)
+    releases = list_releases(ha_path)
+
+    for release in reversed(get_history(ha_path)):
+        release_path = get_release_path(ha_path, release)
+
+        if release_path != active and release in releases:
+            return activate_release(ha_path, release_path, settings)
+
+    raise DeployException('No earlier release to roll back to on %s' % (env.host_string))
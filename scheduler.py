@@ -0,0 +1,180 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import time
+import traceback
+import multiprocessing
+from multiprocessing.connection import wait
+
+from fabric import state
+
+from data_structures import DeployException
+from session import pool_stats
+from session import merge_pool_stats
+from session import print_pool_stats
+from facts import facts_cache
+from plan import is_planning
+
+try:
+    from Crypto import Random
+except ImportError:
+    Random = None
+
+
+# Graph functions
+# --------------------------------------------------------------------------
+def requires(*names):
+    def decorator(func):
+        func.requires = list(names)
+        return func
+
+    return decorator
+
+def get_prerequisites(stages, name):
+    prerequisites = getattr(stages[name], 'requires', None) or []
+
+    return [p for p in prerequisites if p in stages]
+
+def get_stage_order(stages):
+    order = []
+    visiting = []
+
+    def visit(name):
+        if name in order:
+            return
+
+        if name in visiting:
+            cycle = ' -> '.join(visiting + [name])
+            raise DeployException('Stage dependency cycle: %s' % (cycle))
+
+        visiting.append(name)
+
+        for prerequisite in get_prerequisites(stages, name):
+            visit(prerequisite)
+
+        visiting.pop()
+        order.append(name)
+
+    for name in stages:
+        visit(name)
+
+    return order
+
+
+# Runner functions
+# --------------------------------------------------------------------------
+def run_stage(stage, writer):
+    # Paramiko connections cannot be shared with a forked process, so the
+    # pool is per stage process and starts empty here
+    if Random:
+        Random.atfork()
+
+    state.connections.clear()
+    pool_stats['hits'] = 0
+    pool_stats['misses'] = 0
+
+    # Reload facts from disk, earlier stages may have updated them
+    facts_cache.clear()
+
+    try:
+        stage()
+    finally:
+        print_pool_stats(getattr(stage, 'name', 'stage'))
+
+        # The parent sums every stage's counts for its own summary
+        writer.send(dict(pool_stats))
+        writer.close()
+
+def collect_pool_stats(reader):
+    try:
+        if reader.poll():
+            merge_pool_stats(reader.recv())
+    except (EOFError, OSError):
+        pass
+
+    reader.close()
+
+def run_stages(stages, concurrency=1):
+    # Planned stages record into this process, in dependency order
+    if is_planning():
+        concurrency = 1
+
+    order   = get_stage_order(stages)
+    context = multiprocessing.get_context('fork')
+    results = {}
+    running = {}
+    pending = list(order)
+
+    while pending or running:
+        for name in list(pending):
+            prerequisites = get_prerequisites(stages, name)
+            statuses = [results[p]['status'] for p in prerequisites if p in results]
+
+            if 'failed' in statuses or 'skipped' in statuses:
+                pending.remove(name)
+                results[name] = {'status': 'skipped', 'elapsed': 0.0}
+                print('[stage] %s skipped, a prerequisite did not finish' % (name))
+                continue
+
+            if len(statuses) < len(prerequisites) or len(running) >= concurrency:
+                continue
+
+            pending.remove(name)
+            print('[stage] %s started' % (name))
+
+            if concurrency > 1:
+                reader, writer = context.Pipe(duplex=False)
+                process = context.Process(target=run_stage, args=(stages[name], writer), name=name)
+                process.start()
+                writer.close()
+                running[name] = (process, reader, time.time())
+                continue
+
+            start = time.time()
+
+            try:
+                stages[name]()
+                status = 'ok'
+            except BaseException:
+                traceback.print_exc()
+                status = 'failed'
+
+            results[name] = {'status': status, 'elapsed': time.time() - start}
+            print('[stage] %s %s' % (name, status))
+
+        if not running:
+            continue
+
+        wait([process.sentinel for process, _, _ in running.values()])
+
+        for name, (process, reader, start) in list(running.items()):
+            if process.is_alive():
+                continue
+
+            process.join()
+            collect_pool_stats(reader)
+            del running[name]
+            status = 'ok' if process.exitcode == 0 else 'failed'
+            results[name] = {'status': status, 'elapsed': time.time() - start}
+            print('[stage] %s %s' % (name, status))
+
+    return results
+
+def print_stage_summary(results, order):
+    width = max([len(name) for name in order] + [len('STAGE')])
+    row = '{:<%d}  {:<7}  {:>9}' % (width)
+
+    print('')
+    print(row.format('STAGE', 'STATUS', 'TIME (s)'))
+
+    for name in order:
+        result = results[name]
+        print(row.format(name, result['status'], '%.1f' % (result['elapsed'])))
+
+    return [name for name in order if results[name]['status'] != 'ok']
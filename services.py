@@ -0,0 +1,59 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import time
+
+from managed_files import get_file_values
+from managed_files import sync_files
+from pwfile import sync_pwfile
+from readiness import get_probes
+from readiness import wait_for_services
+from helper import get_mosquitto_user
+from data_structures import DeployException
+
+
+# Service routines
+# --------------------------------------------------------------------------
+def sync_managed_files(session, config, *names):
+    return (yield from sync_files(session, names, get_file_values(config), config['managed_files']))
+
+def wait_ready(session, config, name, started_at=None):
+    probes = get_probes(config, [name])
+    failed = yield session.call(wait_for_services, [session.host], probes, config['readiness'], started_at)
+
+    if failed:
+        raise DeployException('%s did not become ready on %s' % (name, session.host))
+
+def install_ha_service(session, config):
+    changed = yield from sync_managed_files(session, config, 'home-assistant.service')
+
+    if changed:
+        yield session.sudo('systemctl daemon-reload')
+
+    cmd = 'systemctl enable home-assistant'
+    yield session.sudo(cmd)
+
+    # Only a changed unit needs a restart, start does nothing when the
+    # service is already running
+    started_at = time.time()
+    cmd = 'systemctl {} home-assistant'.format('restart' if changed else 'start')
+    yield session.sudo(cmd)
+
+    yield from wait_ready(session, config, 'home-assistant', started_at)
+
+def configure_mqtt(session, config):
+    owner = get_mosquitto_user(config['user']).name
+    changed = yield from sync_managed_files(session, config, 'mosquitto.conf')
+
+    yield from sync_pwfile(session, '/etc/mosquitto/pwfile', config['mqtt']['users'], owner)
+
+    if changed:
+        yield session.sudo('systemctl restart mosquitto')
+
+    yield from wait_ready(session, config, 'mosquitto')
@@ -0,0 +1,335 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import io
+import os
+import time
+
+from fabric import state
+from fabric.api import env, output
+from fabric.api import run as fabric_run
+from fabric.api import sudo as fabric_sudo
+from fabric.api import put as fabric_put
+from fabric.network import normalize, join_host_strings
+from fabric.state import default_channel
+from fabric.operations import _AttributeString
+from fabric.operations import _prefix_commands
+from fabric.operations import _prefix_env_vars
+from fabric.operations import _shell_wrap
+from fabric.operations import _sudo_prefix
+
+from capture import capture_output
+from capture import print_tail
+from data_structures import DeployException
+from plan import is_planning
+from plan import record_put
+from plan import record_stream
+from plan import record_command
+from tracing import span
+from tracing import trace_result
+
+
+SUDO_PREFIX         = "sudo -S -p '%(sudo_prompt)s' "
+SESSION_SUDO_PREFIX = "sudo -S -H -p '%(sudo_prompt)s' "
+READY_MARKER        = '__stream_ready__'
+CHUNK_SIZE          = 64 * 1024
+
+pool_stats = {'hits': 0, 'misses': 0}
+command_stats = {'failed': 0}
+
+
+# Session functions
+# --------------------------------------------------------------------------
+def configure_sessions(settings):
+    env.single_session = settings.get('single_session', False)
+
+    if env.single_session:
+        env.sudo_prefix = SESSION_SUDO_PREFIX
+    else:
+        env.sudo_prefix = SUDO_PREFIX
+
+def get_impersonated_user():
+    session_user = env.get('session_user')
+
+    if env.get('single_session') and session_user and session_user != env.user:
+        return session_user
+
+    return None
+
+def record_lookup():
+    if not env.host_string:
+        return
+
+    # Fabric keeps one open connection per user@host:port, so a lookup
+    # for a key already in the cache reuses the authenticated session
+    key = join_host_strings(*normalize(env.host_string))
+
+    if key in state.connections:
+        pool_stats['hits'] += 1
+    else:
+        pool_stats['misses'] += 1
+
+def get_pool_stats():
+    stats = dict(pool_stats)
+    stats['open'] = len(state.connections)
+
+    return stats
+
+def merge_pool_stats(stats):
+    for key in pool_stats:
+        pool_stats[key] += stats.get(key, 0)
+
+def record_result(result, quiet=False):
+    # Quiet commands are probes whose failure is an expected answer
+    if result.failed and not quiet:
+        command_stats['failed'] += 1
+
+    return result
+
+def get_failure_count():
+    return command_stats['failed']
+
+def print_pool_stats(label='session'):
+    stats = get_pool_stats()
+    print('[%s] connection pool: %d hits, %d misses, %d open' % (label, stats['hits'], stats['misses'], stats['open']))
+
+
+# Remote operations
+# --------------------------------------------------------------------------
+def run(cmd, tail=False, **kwargs):
+    # Commands run with tail only keep the end of their output, use it
+    # for builds whose output is never parsed
+    quiet = kwargs.get('quiet', False)
+
+    if is_planning():
+        return record_command('run', cmd, quiet)
+
+    record_lookup()
+    user = get_impersonated_user()
+
+    with span('run', cmd) as args:
+        with capture_output(cmd, kwargs, tail) as log:
+            if user:
+                result = fabric_sudo(cmd, user=user, **kwargs)
+            else:
+                result = fabric_run(cmd, **kwargs)
+
+            log.finish(result)
+
+        trace_result(args, result, log)
+
+    print_tail(result, log)
+
+    return record_result(result, quiet)
+
+def sudo(cmd, tail=False, **kwargs):
+    quiet = kwargs.get('quiet', False)
+
+    if is_planning():
+        return record_command('sudo', cmd, quiet, kwargs.get('user'))
+
+    record_lookup()
+
+    with span('sudo', cmd) as args:
+        with capture_output(cmd, kwargs, tail) as log:
+            result = fabric_sudo(cmd, **kwargs)
+            log.finish(result)
+
+        trace_result(args, result, log)
+
+    print_tail(result, log)
+
+    return record_result(result, quiet)
+
+def put(local_path, remote_path, use_sudo=False, **kwargs):
+    if is_planning():
+        return record_put(local_path, remote_path, use_sudo)
+
+    record_lookup()
+    user = get_impersonated_user()
+    name = '{} -> {}'.format(getattr(local_path, 'name', local_path), remote_path)
+
+    with span('put', name) as args:
+        if isinstance(local_path, str) and os.path.isfile(local_path):
+            args['upload_bytes'] = os.path.getsize(local_path)
+
+        if user and not use_sudo:
+            result = fabric_put(local_path, remote_path, use_sudo=True, **kwargs)
+
+            for path in result:
+                cmd = 'chown {}:{} {}'.format(user, user, path)
+                fabric_sudo(cmd)
+        else:
+            result = fabric_put(local_path, remote_path, use_sudo=use_sudo, **kwargs)
+
+        args['exit_code'] = 1 if result.failed else 0
+
+    return record_result(result)
+
+def wait_until_ready(channel, prompt, password, user):
+    buffered = ''
+    prompted = False
+
+    # The command echoes a marker to stderr once sudo has authenticated,
+    # anything before it may be a password prompt. Whatever else arrived
+    # on stderr is handed back with the result
+    while READY_MARKER not in buffered:
+        if channel.recv_stderr_ready():
+            buffered += channel.recv_stderr(CHUNK_SIZE).decode('utf-8', 'replace')
+        elif channel.exit_status_ready():
+            # The shell exited before the command started, a failed cd()
+            # or prefix() never reaches the marker
+            return False, buffered
+        else:
+            time.sleep(0.01)
+
+        if prompt in buffered and READY_MARKER not in buffered:
+            if prompted:
+                raise DeployException('sudo rejected the password for %s' % (user))
+
+            channel.sendall((password or '') + '\n')
+            buffered = buffered.replace(prompt, '')
+            prompted = True
+
+    return True, buffered.replace(READY_MARKER + '\n', '', 1)
+
+def drain(channel, sink, errors):
+    stdout_bytes = 0
+    stderr_bytes = 0
+
+    while channel.recv_ready():
+        data = channel.recv(CHUNK_SIZE)
+        stdout_bytes += len(data)
+
+        if sink is not None:
+            sink.write(data)
+
+    while channel.recv_stderr_ready():
+        data = channel.recv_stderr(CHUNK_SIZE)
+        stderr_bytes += len(data)
+        errors.append(data)
+
+    return stdout_bytes, stderr_bytes
+
+def stream(cmd, source=None, sink=None, use_sudo=False, user=None):
+    impersonated = get_impersonated_user()
+
+    if impersonated and not use_sudo:
+        use_sudo = True
+        user = impersonated
+
+    if is_planning():
+        return record_stream(cmd, sink, use_sudo, user)
+
+    record_lookup()
+
+    # The marker goes after any cd() or prefix(), a failed prefix ends the
+    # command before it is ready instead of running it in the wrong place
+    command = '{{ echo {} >&2; {}; }}'.format(READY_MARKER, cmd)
+    sudo_prefix = _sudo_prefix(user) if use_sudo else None
+    wrapped = _shell_wrap(_prefix_env_vars(_prefix_commands(command, 'remote')), True, True, sudo_prefix)
+
+    if output.running:
+        which = 'sudo' if use_sudo else 'run'
+        print('[%s] %s (streamed): %s' % (env.host_string, which, cmd))
+
+    with span('stream', cmd) as args:
+        channel = default_channel()
+        channel.exec_command(wrapped)
+        sent = 0
+        stdout_bytes = 0
+        ready, buffered = wait_until_ready(channel, env.sudo_prompt, env.password, env.user)
+        errors = [buffered.encode('utf-8')]
+
+        if ready:
+            while source is not None:
+                stdout_bytes += drain(channel, sink, errors)[0]
+                data = source.read(CHUNK_SIZE)
+
+                if not data:
+                    break
+
+                channel.sendall(data)
+                sent += len(data)
+
+            channel.shutdown_write()
+
+            while not channel.exit_status_ready() or channel.recv_ready() or channel.recv_stderr_ready():
+                count = drain(channel, sink, errors)
+                stdout_bytes += count[0]
+
+                if not any(count):
+                    time.sleep(0.01)
+
+        return_code = channel.recv_exit_status()
+        channel.close()
+
+        stderr = b''.join(errors)
+        result = _AttributeString(stderr.decode('utf-8', 'replace'))
+        result.return_code = return_code
+        result.failed = return_code != 0 or not ready
+        result.succeeded = not result.failed
+
+        args['exit_code'] = return_code
+        args['upload_bytes'] = sent
+        args['stdout_bytes'] = stdout_bytes
+        args['stderr_bytes'] = len(stderr)
+
+    if result.failed and output.stderr:
+        print('[%s] stream failed (%d): %s' % (env.host_string, return_code, result.strip()))
+
+    return record_result(result)
+
+
+# Routine functions
+# --------------------------------------------------------------------------
+class FabricSession(object):
+    # Routines shared with the engine are written against run, sudo,
+    # stream, put and call. Each call is yielded, here it has already run
+    # and the result is handed straight back, the engine awaits it
+    can_fork = True
+
+    @property
+    def host(self):
+        return env.host_string
+
+    @property
+    def address(self):
+        return normalize(env.host_string)[1]
+
+    def run(self, cmd, quiet=False):
+        return run(cmd, quiet=quiet)
+
+    def sudo(self, cmd, user=None, quiet=False):
+        return sudo(cmd, user=user, quiet=quiet)
+
+    def stream(self, cmd, source=None, use_sudo=False):
+        return stream(cmd, source=io.BytesIO(source) if source is not None else None, use_sudo=use_sudo)
+
+    def put(self, content, remote_path, use_sudo=False, mode=None):
+        cmd = 'cat > {}'.format(remote_path)
+
+        if mode:
+            cmd += ' && chmod {} {}'.format(mode, remote_path)
+
+        return self.stream(cmd, content, use_sudo)
+
+    def call(self, func, *args):
+        return func(*args)
+
+fabric_session = FabricSession()
+
+def run_routine(routine):
+    result = None
+
+    try:
+        while True:
+            result = routine.send(result)
+    except StopIteration as stop:
+        return stop.value
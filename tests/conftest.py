@@ -0,0 +1,59 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import sys
+import stat
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+PASSWORD = 'secret'
+
+# Stands in for "docker exec -i NAME ..." and runs the command locally with
+# a fake sudo first on the path
+RUNTIME = '''#!/bin/sh
+shift 3
+PATH="{bin_dir}:$PATH" exec "$@"
+'''
+
+# Prompts like sudo -S -p and checks the password, -u is ignored
+SUDO = '''#!/bin/sh
+prompt=""
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -S|-H) shift;;
+        -p) prompt="$2"; shift 2;;
+        -u) shift 2;;
+        *) break;;
+    esac
+done
+printf '%s' "$prompt" >&2
+read -r password
+[ "$password" = "{password}" ] || {{ echo "Sorry, try again." >&2; exit 1; }}
+exec "$@"
+'''
+
+
+def write_script(path, content):
+    with open(path, 'w') as script:
+        script.write(content)
+
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+
+@pytest.fixture
+def runtime(tmp_path):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    write_script(str(bin_dir / 'sudo'), SUDO.format(password=PASSWORD))
+    write_script(str(tmp_path / 'runtime'), RUNTIME.format(bin_dir=bin_dir))
+
+    return str(tmp_path / 'runtime')
@@ -0,0 +1,175 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import getpass
+import asyncio
+
+import pytest
+
+from conftest import PASSWORD
+from engine import LocalBackend
+from engine import HostSession
+from engine import run_engine
+from engine import run_routine
+from pwfile import sync_pwfile
+import pwfile
+from managed_files import sync_files
+import managed_files
+from data_structures import MosquittoUser
+from data_structures import DeployException
+
+
+def get_config(tmp_path, runtime, hosts):
+    return {    'cache':    {'dir': str(tmp_path / 'cache')},
+                'engine':   {   'backend':      'local',
+                                'runtime':      runtime,
+                                'containers':   dict([(host, 'c-' + host) for host in hosts])   }   }
+
+def get_session(tmp_path, runtime, password=PASSWORD):
+    config = get_config(tmp_path, runtime, ['h'])
+    backend = LocalBackend('h', 'c-h', runtime)
+
+    return HostSession('h', backend, 'pi', password, config)
+
+
+# Backend tests
+# --------------------------------------------------------------------------
+def test_requires_container():
+    with pytest.raises(DeployException):
+        LocalBackend('h', None)
+
+def test_run(tmp_path, runtime):
+    session = get_session(tmp_path, runtime)
+    result = asyncio.run(session.run('echo out; echo err >&2; exit 3', quiet=True))
+
+    assert result == 'out'
+    assert result.stderr == 'err'
+    assert result.return_code == 3
+    assert result.failed
+
+def test_sudo_feeds_source_after_password(tmp_path, runtime):
+    session = get_session(tmp_path, runtime)
+    result = asyncio.run(session.sudo('cat', quiet=True, source=b'payload'))
+
+    assert result.succeeded
+    assert result == 'payload'
+
+def test_sudo_wrong_password(tmp_path, runtime):
+    session = get_session(tmp_path, runtime, 'wrong')
+    result = asyncio.run(session.sudo('true', quiet=True))
+
+    assert result.failed
+    assert 'Sorry' in result.stderr
+
+def test_put(tmp_path, runtime):
+    session = get_session(tmp_path, runtime)
+    path = tmp_path / 'put.bin'
+    content = b'x' * 300000
+    result = asyncio.run(session.put(content, str(path), mode='600'))
+
+    assert result.succeeded
+    assert path.read_bytes() == content
+    assert oct(path.stat().st_mode & 0o777) == '0o600'
+
+
+# Runner tests
+# --------------------------------------------------------------------------
+def test_fan_out_is_bounded(tmp_path, runtime):
+    hosts = ['h%d' % i for i in range(8)]
+    config = get_config(tmp_path, runtime, hosts)
+    running = []
+    peak = []
+
+    async def host_task(session):
+        running.append(session.host)
+        peak.append(len(running))
+        result = await session.run('sleep 0.1; echo {}'.format(session.host), quiet=True)
+        running.remove(session.host)
+        assert result == session.host
+
+    results = run_engine(host_task, hosts, 4, config, {}, 'pi', PASSWORD)
+
+    assert sorted(results) == hosts
+    assert all([r['status'] == 'ok' for r in results.values()])
+    assert max(peak) == 4
+
+def test_overrides_are_per_host(tmp_path, runtime):
+    hosts = ['h1', 'h2']
+    config = get_config(tmp_path, runtime, hosts)
+    config['value'] = {'name': 'default'}
+    seen = {}
+
+    async def host_task(session):
+        seen[session.host] = session.config['value']['name']
+
+    run_engine(host_task, hosts, 2, config, {'h1': {'value': {'name': 'override'}}}, 'pi', PASSWORD)
+
+    assert seen == {'h1': 'override', 'h2': 'default'}
+    assert config['value']['name'] == 'default'
+
+def test_failures_are_reported(tmp_path, runtime):
+    hosts = ['h1', 'missing']
+    config = get_config(tmp_path, runtime, ['h1'])
+
+    async def host_task(session):
+        pass
+
+    results = run_engine(host_task, hosts, 2, config, {}, 'pi', PASSWORD)
+
+    assert results['h1']['status'] == 'ok'
+    assert results['missing']['status'] == 'failed'
+    assert 'engine.containers' in results['missing']['error']
+
+
+# Task tests
+# --------------------------------------------------------------------------
+def test_sync_pwfile(tmp_path, runtime, monkeypatch):
+    session = get_session(tmp_path, runtime)
+
+    # Every user list would go to a pool, the engine must never fork one
+    monkeypatch.setattr(pwfile, 'PARALLEL_THRESHOLD', 1)
+    monkeypatch.delattr(pwfile.multiprocessing, 'get_context')
+    path = str(tmp_path / 'pwfile')
+    users = [MosquittoUser('user%d' % i) for i in range(3)]
+
+    # chown to the current user keeps the test unprivileged
+    owner = getpass.getuser()
+
+    for user in users:
+        user.password = 'password'
+
+    assert asyncio.run(run_routine(sync_pwfile(session, path, users, owner)))
+    assert not asyncio.run(run_routine(sync_pwfile(session, path, users, owner)))
+
+    with open(path) as pwfile_data:
+        assert [line.split(':')[0] for line in pwfile_data.read().splitlines()] == ['user0', 'user1', 'user2']
+
+def test_sync_files(tmp_path, runtime, monkeypatch, capsys):
+    session = get_session(tmp_path, runtime)
+    src = tmp_path / 'big.txt'
+    dest = tmp_path / 'dest' / 'big.txt'
+    settings = {    'files':            {'big': {'src': str(src), 'dest': str(dest), 'mode': '0644'}},
+                    'delta_min_size':   1024,
+                    'block_size':       1024    }
+
+    # The helper normally lives under /var/cache, keep the test unprivileged
+    monkeypatch.setattr(managed_files, 'DELTA_HELPER', str(tmp_path / 'delta.py'))
+
+    def sync():
+        return asyncio.run(run_routine(sync_files(session, ['big'], {}, settings)))
+
+    src.write_bytes(b''.join([b'line %d\n' % (i) for i in range(5000)]))
+    assert sync() == ['big']
+
+    src.write_bytes(src.read_bytes() + b'tail\n')
+    assert sync() == ['big']
+    assert 'byte delta' in capsys.readouterr().out
+
+    assert sync() == []
+    assert dest.read_bytes() == src.read_bytes()
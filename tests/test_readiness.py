@@ -0,0 +1,126 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import time
+import socket
+import threading
+import http.server
+
+import pytest
+
+from readiness import get_probes
+from readiness import check_readiness
+
+
+SETTINGS = {'concurrency': 4, 'timeout': 3.0, 'optional_timeout': 0.5}
+
+
+# Stand-in listeners
+# --------------------------------------------------------------------------
+class Handler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        # Home Assistant answers its API without a token with a 401
+        self.send_response(401)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def get_free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+def start_http(port=0):
+    server = http.server.HTTPServer(('127.0.0.1', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+@pytest.fixture
+def tcp_listener():
+    # Accepts connections and never answers, like mosquitto to an HTTP probe
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(8)
+
+    yield listener.getsockname()[1]
+
+    listener.close()
+
+@pytest.fixture
+def http_listener():
+    server = start_http()
+
+    yield server.server_address[1]
+
+    server.shutdown()
+    server.server_close()
+
+def get_probe(name, port, path=None, required=True):
+    return {'name': name, 'port': port, 'path': path, 'required': required}
+
+
+# Probe tests
+# --------------------------------------------------------------------------
+def test_tcp_probe(tcp_listener):
+    probes = [get_probe('mqtt', tcp_listener)]
+    results = check_readiness(['pi@127.0.0.1'], probes, SETTINGS)
+
+    assert results['pi@127.0.0.1'][0]['time_to_ready'] is not None
+
+def test_http_probe_accepts_any_status(http_listener):
+    probes = [get_probe('home-assistant', http_listener, '/api/')]
+    results = check_readiness(['127.0.0.1'], probes, SETTINGS)
+
+    assert results['127.0.0.1'][0]['time_to_ready'] is not None
+
+def test_http_probe_needs_a_status_line(tcp_listener):
+    settings = dict(SETTINGS, timeout=0.5)
+    probes = [get_probe('home-assistant', tcp_listener, '/api/')]
+    results = check_readiness(['127.0.0.1'], probes, settings)
+
+    assert results['127.0.0.1'][0]['time_to_ready'] is None
+
+def test_optional_probe_gives_up_early():
+    probes = [get_probe('22/tcp', get_free_port(), required=False)]
+
+    start = time.time()
+    results = check_readiness(['127.0.0.1'], probes, SETTINGS)
+
+    assert results['127.0.0.1'][0]['time_to_ready'] is None
+    assert time.time() - start < 1.5
+
+def test_waits_for_late_listener():
+    port = get_free_port()
+    servers = []
+    timer = threading.Timer(0.5, lambda: servers.append(start_http(port)))
+    timer.start()
+
+    try:
+        results = check_readiness(['127.0.0.1'], [get_probe('home-assistant', port, '/api/')], SETTINGS)
+    finally:
+        timer.join()
+
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+    assert 0.5 <= results['127.0.0.1'][0]['time_to_ready'] < 3.0
+
+
+# Definition tests
+# --------------------------------------------------------------------------
+def test_firewall_ports_are_optional():
+    config = {  'readiness':    {'probes': {'home-assistant': {'port': 8123, 'path': '/api/'}}},
+                'firewall':     {'enable': True, 'allowed': ['ssh', '8123/tcp', '1883/tcp']}   }
+    probes = get_probes(config)
+
+    assert [(p['port'], p['required']) for p in probes] == [(8123, True), (22, False), (1883, False)]
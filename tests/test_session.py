@@ -0,0 +1,133 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import io
+import queue
+import threading
+import subprocess
+from contextlib import contextmanager
+
+import pytest
+from fabric.api import env
+from fabric.api import cd
+
+import session
+
+
+# Stand-in channel
+# --------------------------------------------------------------------------
+class LocalChannel(object):
+    # Runs the command locally behind the parts of a paramiko channel that
+    # session.stream uses
+
+    def __init__(self):
+        self.process = None
+        self.stdout = queue.Queue()
+        self.stderr = queue.Queue()
+        self.readers = []
+
+    def read(self, pipe, chunks):
+        for data in iter(lambda: pipe.read1(session.CHUNK_SIZE), b''):
+            chunks.put(data)
+
+    def exec_command(self, command):
+        self.process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        for pipe, chunks in [(self.process.stdout, self.stdout), (self.process.stderr, self.stderr)]:
+            reader = threading.Thread(target=self.read, args=(pipe, chunks), daemon=True)
+            reader.start()
+            self.readers.append(reader)
+
+    def recv_ready(self):
+        return not self.stdout.empty()
+
+    def recv(self, size):
+        return self.stdout.get()
+
+    def recv_stderr_ready(self):
+        return not self.stderr.empty()
+
+    def recv_stderr(self, size):
+        return self.stderr.get()
+
+    def exit_status_ready(self):
+        # Only report the exit once all output has been queued
+        return self.process.poll() is not None and not any([r.is_alive() for r in self.readers])
+
+    def sendall(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        try:
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            pass
+
+    def shutdown_write(self):
+        self.process.stdin.close()
+
+    def recv_exit_status(self):
+        return self.process.wait()
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def channel(monkeypatch):
+    monkeypatch.setattr(session, 'default_channel', LocalChannel)
+    monkeypatch.setitem(env, 'shell', '/bin/sh -c')
+    monkeypatch.setitem(env, 'host_string', None)
+
+def run_stream(*args, **kwargs):
+    results = []
+    worker = threading.Thread(target=lambda: results.append(session.stream(*args, **kwargs)), daemon=True)
+    worker.start()
+    worker.join(10)
+
+    assert not worker.is_alive(), 'stream did not return'
+
+    return results[0]
+
+
+# Stream tests
+# --------------------------------------------------------------------------
+def test_stream(channel, tmp_path):
+    path = tmp_path / 'out'
+    result = run_stream('cat > {}; echo done >&2'.format(path), source=io.BytesIO(b'payload'))
+
+    assert result.succeeded
+    assert result.strip() == 'done'
+    assert path.read_bytes() == b'payload'
+
+def test_stream_under_failed_cd(channel, tmp_path):
+    path = tmp_path / 'out'
+
+    # cat would wait for stdin forever if it ran without the marker
+    with cd(str(tmp_path / 'missing')):
+        result = run_stream('pwd > {0}; cat > {0}'.format(path), source=io.BytesIO(b'payload'))
+
+    assert result.failed
+    assert not path.exists()
+
+def test_stream_counts_each_output(channel, monkeypatch):
+    traced = {}
+
+    @contextmanager
+    def span(category, name):
+        yield traced
+
+    monkeypatch.setattr(session, 'span', span)
+
+    # stderr written next to the marker is read before the command starts
+    run_stream('echo early >&2; printf 12345; echo late >&2')
+
+    assert traced['stdout_bytes'] == 5
+    assert traced['stderr_bytes'] == len('early\nlate\n')
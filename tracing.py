@@ -0,0 +1,166 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import json
+import time
+import atexit
+from contextlib import contextmanager
+
+from fabric.api import env
+from fabric.api import task as fabric_task
+from fabric.tasks import WrappedCallableTask
+
+
+COMMAND_CATEGORIES  = ['run', 'sudo', 'put', 'stream']
+MAIN_PID            = os.getpid()
+
+named_processes = []
+task_stack = []
+
+
+# Trace files
+# --------------------------------------------------------------------------
+def is_enabled():
+    return env.get('trace_settings', {}).get('enable', False)
+
+def get_trace_dir():
+    return os.path.join(env.cache_dir, 'traces', env.deploy_id)
+
+def write_events(events):
+    trace_dir = get_trace_dir()
+
+    if not os.path.exists(trace_dir):
+        os.makedirs(trace_dir)
+
+    # Forked stages and fleet hosts each write their own file, they are
+    # merged when the main process exits
+    path = os.path.join(trace_dir, '%d.jsonl' % (os.getpid()))
+
+    with open(path, 'a') as trace_data:
+        for event in events:
+            trace_data.write(json.dumps(event, sort_keys=True) + '\n')
+
+def name_process(label):
+    pid = os.getpid()
+
+    if pid in named_processes:
+        return []
+
+    named_processes.append(pid)
+
+    if pid == MAIN_PID:
+        atexit.register(export_trace)
+
+    return [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': label}}]
+
+@contextmanager
+def span(category, name, **args):
+    if not is_enabled():
+        yield args
+        return
+
+    host = env.host_string or 'local'
+    events = name_process('%s %s' % (host, name) if category == 'task' else host)
+    start = time.time()
+
+    try:
+        yield args
+    finally:
+        args['host'] = host
+        events.append({ 'name':     name,
+                        'cat':      category,
+                        'ph':       'X',
+                        'ts':       int(start * 1000000),
+                        'dur':      int((time.time() - start) * 1000000),
+                        'pid':      os.getpid(),
+                        'tid':      0,
+                        'args':     args    })
+
+        write_events(events)
+
+def get_size(text, stream=None):
+    if stream is not None:
+        return stream.size
+
+    return len((text or '').encode('utf-8', 'replace'))
+
+def trace_result(args, result, log):
+    args['exit_code'] = getattr(result, 'return_code', None)
+    args['stdout_bytes'] = get_size(result, log.stdout)
+    args['stderr_bytes'] = get_size(getattr(result, 'stderr', ''), log.stderr)
+
+
+# Task class
+# --------------------------------------------------------------------------
+class TracedTask(WrappedCallableTask):
+    def run(self, *args, **kwargs):
+        task_stack.append(self.name)
+
+        try:
+            with span('task', self.name):
+                return super(TracedTask, self).run(*args, **kwargs)
+        finally:
+            task_stack.pop()
+
+def get_current_task():
+    return task_stack[-1] if task_stack else None
+
+def task(*args, **kwargs):
+    # Drop in for fabric's @task and @task(...) that traces every call
+    if len(args) == 1 and callable(args[0]) and not kwargs:
+        return TracedTask(args[0])
+
+    kwargs.setdefault('task_class', TracedTask)
+
+    return fabric_task(*args, **kwargs)
+
+
+# Reports
+# --------------------------------------------------------------------------
+def load_events(trace_dir):
+    events = []
+
+    for name in sorted(os.listdir(trace_dir)):
+        if name.endswith('.jsonl'):
+            with open(os.path.join(trace_dir, name)) as trace_data:
+                events.extend([json.loads(line) for line in trace_data if line.strip()])
+
+    return events
+
+def print_top_commands(events, count):
+    commands = [e for e in events if e.get('cat') in COMMAND_CATEGORIES]
+    commands.sort(key=lambda e: e['dur'], reverse=True)
+    row = '{:>9}  {:<6}  {:<24}  {}'
+
+    print('')
+    print(row.format('TIME (s)', 'TYPE', 'HOST', 'COMMAND'))
+
+    for event in commands[:count]:
+        command = ' '.join(event['name'].split())[:80]
+        print(row.format('%.1f' % (event['dur'] / 1000000.0), event['cat'], event['args']['host'], command))
+
+def export_trace():
+    if os.getpid() != MAIN_PID:
+        return
+
+    trace_dir = get_trace_dir()
+
+    if not os.path.exists(trace_dir):
+        return
+
+    events = load_events(trace_dir)
+    path = trace_dir + '.json'
+
+    with open(path, 'w') as trace_data:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_data)
+
+    print_top_commands(events, env.trace_settings['top'])
+    print('')
+    print('Trace written to %s, open it in chrome://tracing or ui.perfetto.dev' % (path))
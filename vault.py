@@ -0,0 +1,172 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import re
+import sys
+import json
+import base64
+from getpass import getpass
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+except ImportError:
+    Fernet = None
+
+from data_structures import DeployException
+from plan import is_planning
+
+
+ENV_PREFIX      = 'HA_DEPLOY_SECRET_'
+ENV_PASSPHRASE  = 'HA_DEPLOY_VAULT_PASSPHRASE'
+KDF_ITERATIONS  = 200000
+
+settings = {'file': 'secrets.vault', 'prompt': True}
+vault = {'key': None, 'secrets': None}
+resolved = {}
+
+
+# Vault file
+# --------------------------------------------------------------------------
+def configure_vault(vault_settings):
+    settings.update(vault_settings)
+
+def get_env_name(name):
+    return ENV_PREFIX + re.sub('[^A-Z0-9]', '_', name.upper())
+
+def get_passphrase(confirm=False):
+    passphrase = os.environ.get(ENV_PASSPHRASE)
+
+    if passphrase is not None:
+        return passphrase
+
+    if not sys.stdin.isatty():
+        raise DeployException('%s is not set and there is no terminal to ask for the vault passphrase' % (ENV_PASSPHRASE))
+
+    passphrase = getpass('Vault passphrase: ')
+
+    if confirm and getpass('Repeat the vault passphrase: ') != passphrase:
+        raise DeployException('The vault passphrases do not match')
+
+    return passphrase
+
+def get_fernet(salt, confirm=False):
+    if Fernet is None:
+        raise DeployException('The secrets vault needs the cryptography package')
+
+    if vault['key'] is None:
+        kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=KDF_ITERATIONS, backend=default_backend())
+        vault['key'] = base64.urlsafe_b64encode(kdf.derive(get_passphrase(confirm).encode('utf-8')))
+
+    return Fernet(vault['key'])
+
+def load_vault():
+    if vault['secrets'] is not None:
+        return vault['secrets']
+
+    if not os.path.exists(settings['file']):
+        vault['secrets'] = {}
+        return vault['secrets']
+
+    with open(settings['file']) as vault_data:
+        sealed = json.load(vault_data)
+
+    fernet = get_fernet(base64.b64decode(sealed['salt']))
+
+    try:
+        vault['secrets'] = json.loads(fernet.decrypt(sealed['data'].encode('ascii')).decode('utf-8'))
+    except InvalidToken:
+        vault['key'] = None
+        raise DeployException('Could not decrypt %s, check the passphrase' % (settings['file']))
+
+    return vault['secrets']
+
+def save_vault(secrets):
+    if os.path.exists(settings['file']):
+        with open(settings['file']) as vault_data:
+            salt = base64.b64decode(json.load(vault_data)['salt'])
+    else:
+        salt = os.urandom(16)
+
+    data = get_fernet(salt, confirm=True).encrypt(json.dumps(secrets, sort_keys=True).encode('utf-8'))
+    sealed = {'salt': base64.b64encode(salt).decode('ascii'), 'data': data.decode('ascii')}
+    partial_path = settings['file'] + '.partial'
+
+    # The vault only ever holds secrets, keep it private to this user
+    fd = os.open(partial_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+
+    with os.fdopen(fd, 'w') as vault_data:
+        json.dump(sealed, vault_data, indent=4)
+
+    os.rename(partial_path, settings['file'])
+    vault['secrets'] = secrets
+
+
+# Secret functions
+# --------------------------------------------------------------------------
+def prompt_secret(name):
+    first = getpass('Enter secret for %s: ' % (name))
+    second = getpass('Renter the secret for %s: ' % (name))
+
+    if first != second:
+        raise DeployException('The secrets for %s do not match' % (name))
+
+    return first
+
+def get_secret(name):
+    # Plans never prompt and never write a secret into a plan file
+    if is_planning():
+        return '<%s>' % (name)
+
+    # The environment wins so automation never needs the vault file
+    value = os.environ.get(get_env_name(name))
+
+    if value is not None:
+        return value
+
+    if name in resolved:
+        return resolved[name]
+
+    secrets = load_vault()
+
+    if name in secrets:
+        value = secrets[name]
+    elif not settings['prompt'] or not sys.stdin.isatty():
+        raise DeployException('No secret for %s, set %s or add it with fab set_secret:%s' % (name, get_env_name(name), name))
+    else:
+        value = prompt_secret(name)
+
+    resolved[name] = value
+
+    return value
+
+def set_secret(name, value):
+    secrets = dict(load_vault())
+    secrets[name] = value
+    save_vault(secrets)
+
+def lazy_secret(name):
+    return lambda: get_secret(name)
+
+def resolve_secrets(users):
+    # Forked stages and fleet hosts cannot prompt, ask once up front
+    for user in users:
+        user.password
+
+def get_secret_source(name):
+    if os.environ.get(get_env_name(name)) is not None:
+        return 'env'
+
+    if os.path.exists(settings['file']) and name in load_vault():
+        return 'vault'
+
+    return 'missing'
@@ -0,0 +1,172 @@
+# --------------------------------------< HEADER >--------------------------------------
+#
+#       Home Assistant Installer for Raspberry Pi
+#       By: Fredrick Stakem
+#       Date: 10.18.26
+#
+# --------------------------------------|~~~~~~~~|--------------------------------------
+
+
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import tarfile
+import tempfile
+
+from fabric.api import env
+
+from session import run
+from session import stream
+from data_structures import DeployException
+
+
+# Local store functions
+# --------------------------------------------------------------------------
+def get_store_path(*parts):
+    return os.path.join(env.cache_dir, 'wheels', *parts)
+
+def load_index(key):
+    path = get_store_path('%s.json' % (key))
+
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as index_data:
+        return json.load(index_data)
+
+def save_index(key, index):
+    path = get_store_path('%s.json' % (key))
+
+    with open(path + '.partial', 'w') as index_data:
+        json.dump(index, index_data, indent=4, sort_keys=True)
+
+    os.rename(path + '.partial', path)
+
+def hash_file(path):
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as file_data:
+        for chunk in iter(lambda: file_data.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def store_wheel(path):
+    digest = hash_file(path)
+    blob_path = get_store_path('store', digest)
+
+    if not os.path.exists(blob_path):
+        shutil.copyfile(path, blob_path + '.partial')
+        os.rename(blob_path + '.partial', blob_path)
+
+    return digest
+
+
+# Remote functions
+# --------------------------------------------------------------------------
+def get_remote_wheels(wheel_path):
+    cmd = 'mkdir -p {0} && cd {0} && for f in *.whl; do [ -f "$f" ] && sha256sum "$f"; done; true'.format(wheel_path)
+    result = run(cmd)
+    wheels = {}
+
+    for line in result.splitlines():
+        tokens = line.split()
+
+        if len(tokens) == 2 and tokens[1].endswith('.whl'):
+            wheels[tokens[1]] = tokens[0]
+
+    return wheels
+
+def upload_wheels(key, wheel_path):
+    index = load_index(key)
+    remote = get_remote_wheels(wheel_path)
+    missing = [name for name in sorted(index) if remote.get(name) != index[name]]
+
+    if not missing:
+        return remote
+
+    print('[%s] uploading %d of %d wheels' % (env.host_string, len(missing), len(index)))
+
+    with tempfile.TemporaryFile() as archive:
+        with tarfile.open(fileobj=archive, mode='w') as tar:
+            for name in missing:
+                tar.add(get_store_path('store', index[name]), arcname=name)
+
+        archive.seek(0)
+        cmd = 'tar xf - -C {}'.format(wheel_path)
+        result = stream(cmd, source=archive)
+
+    if result.failed:
+        raise DeployException('Could not upload %d wheels to %s' % (len(missing), env.host_string))
+
+    for name in missing:
+        remote[name] = index[name]
+
+    return remote
+
+def download_wheels(key, wheel_path, known):
+    remote = get_remote_wheels(wheel_path)
+    new = [name for name in sorted(remote) if known.get(name) != remote[name]]
+
+    if not new:
+        return
+
+    print('[%s] collecting %d new wheels' % (env.host_string, len(new)))
+    cmd = 'tar cf - -C {} {}'.format(wheel_path, ' '.join(new))
+    work_dir = tempfile.mkdtemp()
+
+    try:
+        with tempfile.TemporaryFile() as archive:
+            result = stream(cmd, sink=archive)
+
+            if result.failed:
+                return
+
+            archive.seek(0)
+
+            with tarfile.open(fileobj=archive, mode='r') as tar:
+                tar.extractall(work_dir)
+
+        # Fleet hosts run in parallel processes, reload the index under the
+        # lock so wheels another host just added are kept
+        with open(get_store_path('%s.lock' % (key)), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            index = load_index(key)
+
+            for name in new:
+                index[name] = store_wheel(os.path.join(work_dir, name))
+
+            save_index(key, index)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+# Install functions
+# --------------------------------------------------------------------------
+def pip_install(requirements, key, wheel_path):
+    if not os.path.exists(get_store_path('store')):
+        os.makedirs(get_store_path('store'))
+
+    known = upload_wheels(key, wheel_path)
+
+    cmd = 'pip install --no-index --find-links {} {}'.format(wheel_path, requirements)
+    result = run(cmd, quiet=True)
+
+    if result.succeeded:
+        return result
+
+    # Something in the dependency closure has no wheel yet, build the
+    # missing ones on the host and keep them for every later install
+    cmd = 'pip wheel --find-links {0} --wheel-dir {0} {1}'.format(wheel_path, requirements)
+    result = run(cmd, tail=True)
+
+    if result.failed:
+        return result
+
+    download_wheels(key, wheel_path, known)
+
+    cmd = 'pip install --no-index --find-links {} {}'.format(wheel_path, requirements)
+
+    return run(cmd, tail=True)